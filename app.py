@@ -7,13 +7,53 @@
 # - Modal/backdrop fix + button click fixes
 # - Minimal change: /api/intro always sends an intro (no double-intro warning)
 # - NEW: Adjacent (anticipatory) processing — quick teaser reply on interim ASR
-
-import base64, re, time, random, os, threading, json, sys
-from collections import deque, defaultdict
+# - NEW: Streamed TTS — replies carry /api/audio/<id>, MP3 bytes are forwarded as they arrive
+#   (synthesized on a bounded pool from the moment the text is known; identical texts share one call)
+# - NEW: /api/reply_stream — Gemini token streaming, each finished sentence goes to TTS at once (SSE)
+# - Serving: `gunicorn app:app` picks up gunicorn.conf.py (gevent workers), so slow upstream calls
+#   yield instead of holding a worker thread each
+# - One process serves everything: sessions, clips, turns and client locks are in-process, so run ONE
+#   worker (see gunicorn.conf.py); multi-worker/horizontal scaling is not supported. The turn log
+#   (below) only rebuilds conversations after a restart or eviction
+# - Sessions are bounded: idle TTL + LRU cap, swept in the background; counters on /api/stats
+# - TTS cache (memory + disk) keyed on voice/model/settings/format/text; fixed lines can be pre-warmed
+# - Per-request Deadline shrinks every later upstream timeout/retry; out of budget → text-only reply
+# - Interim prefixes start a speculative final reply; a matching final transcript commits it
+# - Prompt prefix built once (optionally held in Gemini cachedContents)
+# - Finished clips are served raw with Range/ETag/Cache-Control from a byte-capped in-memory buffer
+# - /metrics: per-stage latency histograms + outcome/upstream counters (Prometheus text);
+#   TAHLIA_SERVER_TIMING=1 adds a Server-Timing header per response
+# - Upstream scheduler: token bucket + concurrency cap per upstream, finals before teasers, 429
+#   Retry-After pauses the upstream; teasers are shed first
+# - /ws duplex channel (flask-sock) carries interim/final/ack/cancel up and teasers/sentences down;
+#   the REST routes stay as the fallback
+# - Compact ClientState: slotted, list rings of tuple turn records, packed similarity signatures
+# - Prompt history fills a token budget newest-first; older turns fold into a background rolling summary
+# - Identical concurrent Gemini calls share one request (single-flight); teasers briefly cached
+
+import base64, re, time, random, os, threading, json, sys, uuid, hashlib, copy, functools, zlib
+from bisect import bisect_left
+from collections import defaultdict, OrderedDict
+from itertools import islice
+from typing import NamedTuple
+from difflib import SequenceMatcher
 from dataclasses import dataclass, field
-from flask import Flask, request, jsonify, make_response, send_file
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from flask import Flask, request, jsonify, make_response, send_file, Response, g, has_request_context
 from io import BytesIO
 
+try:
+    import fcntl  # POSIX: turn-log appends and compactions lock the file across processes
+except ImportError:
+    fcntl = None
+
+try:
+    from flask_sock import Sock  # optional: the /ws channel; REST routes work without it
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None
+
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -28,40 +68,747 @@ GEMINI_MODEL    = "gemini-2.0-flash"
 
 ASSISTANT_NAME  = "Tahlia"
 
+# Upstream hosts; bench.py points these at its local stand-ins
+GEMINI_BASE_URL = os.environ.get("TAHLIA_GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+ELEVEN_BASE_URL = os.environ.get("TAHLIA_ELEVEN_BASE_URL", "https://api.elevenlabs.io").rstrip("/")
+
+# ========= Metrics =========
+# Prometheus text format without the client library. Histograms: tahlia_stage_seconds{stage} and
+# tahlia_request_seconds{route}. Counters: turn outcomes (every dbg value), regen reasons,
+# speculation results, upstream statuses and retries.
+SERVER_TIMING = os.environ.get("TAHLIA_SERVER_TIMING", "0") == "1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[tuple, float] = defaultdict(float)  # (name, labels) -> value
+        self.hists: dict[tuple, list] = {}                      # (name, labels) -> [per-bucket…, +Inf, sum, count]
+
+    def inc(self, name: str, n: float = 1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += n
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.hists.get(key)
+            if h is None: h = self.hists[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+            h[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            h[-2] += seconds; h[-1] += 1
+
+    def render(self, gauges: dict | None = None) -> str:
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items: return ""
+            esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+        with self.lock:
+            counters, hists = dict(self.counters), {k: list(v) for k, v in self.hists.items()}
+        out, typed = [], set()
+        for (name, labels), v in sorted(counters.items()):
+            if name not in typed: out.append(f"# TYPE {name} counter"); typed.add(name)
+            out.append(f"{name}{fmt(labels)} {v:g}")
+        for (name, labels), h in sorted(hists.items()):
+            if name not in typed: out.append(f"# TYPE {name} histogram"); typed.add(name)
+            cum = 0
+            for b, n in zip(LATENCY_BUCKETS + ("+Inf",), h[:-2]):
+                cum += n
+                out.append(f"{name}_bucket{fmt(labels, [('le', b)])} {cum}")
+            out.append(f"{name}_sum{fmt(labels)} {h[-2]:.6f}")
+            out.append(f"{name}_count{fmt(labels)} {h[-1]}")
+        for name, v in sorted((gauges or {}).items()):
+            out.append(f"# TYPE {name} gauge")
+            out.append(f"{name} {v:g}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+
+_span_sink = threading.local()
+
+@contextmanager
+def span(stage: str):
+    """Time a stage into tahlia_stage_seconds; inside a request (or with_spans()) it also lands in
+    Server-Timing."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        metrics.observe("tahlia_stage_seconds", dt, stage=stage)
+        if has_request_context():
+            g.setdefault("spans", []).append((stage, dt))
+        elif getattr(_span_sink, "spans", None) is not None:
+            _span_sink.spans.append((stage, dt))
+
+def with_spans(fn, *args):
+    """(fn(*args), spans) for pool workers, which have no request g; the request thread adds the
+    spans to its own."""
+    _span_sink.spans = spans = []
+    try:
+        return fn(*args), spans
+    finally:
+        _span_sink.spans = None
+
+def upstream_of(url: str) -> str:
+    return "elevenlabs" if "/text-to-speech/" in (url or "") else "gemini"
+
+class CountingRetry(Retry):
+    """urllib3 Retry that counts each retry it schedules (and the final give-up) per upstream."""
+    def increment(self, method=None, url=None, *args, **kwargs):
+        metrics.inc("tahlia_upstream_retries_total", upstream=upstream_of(url))
+        return super().increment(method, url, *args, **kwargs)
+
+def _count_upstream(r, *args, **kwargs):
+    metrics.inc("tahlia_upstream_responses_total", upstream=upstream_of(r.url), status=str(r.status_code))
+
 # ========= HTTP session with retries =========
 session = requests.Session()
-retry = Retry(total=3, connect=3, read=3, status=3, backoff_factor=0.35,
-              status_forcelist=[429,500,502,503,504], allowed_methods=["GET","POST"], raise_on_status=False)
-adapter = HTTPAdapter(max_retries=retry, pool_connections=20, pool_maxsize=50)
+session.hooks["response"].append(_count_upstream)
+# 429s are not retried here (upstream_post pauses the limiter instead); urllib3 would still retry
+# any 429 carrying Retry-After unless told not to respect the header
+retry = CountingRetry(total=3, connect=3, read=3, status=3, backoff_factor=0.35,
+              status_forcelist=[500,502,503,504], allowed_methods=["GET","POST"], raise_on_status=False,
+              respect_retry_after_header=False)
+# Sized for gevent workers: hundreds of in-flight turns share this pool
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 200))
+adapter = HTTPAdapter(max_retries=retry, pool_connections=20, pool_maxsize=HTTP_POOL_MAXSIZE)
 session.mount("https://", adapter); session.mount("http://", adapter)
 DEFAULT_TIMEOUT = (5, 55)
 
+# Same pool, no adapter retries: used once a request's remaining budget can't absorb a backoff
+session_once = requests.Session()
+session_once.hooks["response"].append(_count_upstream)
+adapter_once = HTTPAdapter(max_retries=Retry(total=0, raise_on_status=False), pool_connections=20, pool_maxsize=HTTP_POOL_MAXSIZE)
+session_once.mount("https://", adapter_once); session_once.mount("http://", adapter_once)
+RETRY_MIN_BUDGET_S = 8.0
+
+# ========= Per-request deadlines =========
+REPLY_BUDGET_S = float(os.environ.get("TAHLIA_REPLY_BUDGET_S", 20))    # /api/reply, /api/reply_stream
+TEASER_BUDGET_S = float(os.environ.get("TAHLIA_TEASER_BUDGET_S", 5))   # /api/adjacent
+AUDIO_BUDGET_S = float(os.environ.get("TAHLIA_AUDIO_BUDGET_S", 30))    # one clip's synthesis
+TTS_MIN_BUDGET_S = 1.0  # a reply with less than this left goes out text-only
+
+class DeadlineExceeded(Exception):
+    pass
+
+PRIORITY_FINAL = 0   # final replies (and their audio)
+PRIORITY_TEASER = 1  # teasers, speculation, prewarm: first to be shed when an upstream is saturated
+
+class Deadline:
+    """Wall-clock budget for one request. Passed down through llm_reply → gemini_* and tts_*, so
+    each upstream call (and each retry/backoff) only gets what is left. Also carries the request's
+    priority for the upstream scheduler."""
+    __slots__ = ("end", "priority")
+    def __init__(self, budget_s: float, priority: int = PRIORITY_FINAL):
+        self.end = time.monotonic() + budget_s
+        self.priority = priority
+
+    def remaining(self) -> float:
+        return self.end - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.05
+
+    def timeout(self, default: tuple) -> tuple:
+        """Clamp a (connect, read) timeout to the remaining budget."""
+        rem = self.remaining()
+        if rem <= 0.05: raise DeadlineExceeded()
+        return (min(default[0], rem), min(default[1], rem))
+
+def bounded(deadline: Deadline | None, timeout: tuple):
+    """(http session, timeout) for one upstream call under an optional deadline."""
+    if deadline is None: return session, timeout
+    return (session if deadline.remaining() > RETRY_MIN_BUDGET_S else session_once), deadline.timeout(timeout)
+
+def backoff(deadline: Deadline | None, seconds: float) -> bool:
+    """Sleep before a retry, unless that would leave no budget for the retry itself."""
+    if deadline is not None and deadline.remaining() < seconds + 0.5: return False
+    time.sleep(seconds)
+    return True
+
+# ========= Upstream scheduler =========
+# One token bucket + concurrency cap per upstream, shared by every request in the worker. Callers
+# queue by priority (finals ahead of teasers); teasers are shed instead of waiting behind finals or
+# for long, and when the queue is full a final evicts a queued teaser. A 429 pauses the whole
+# upstream for its Retry-After rather than each thread retrying on its own schedule. Slots are held
+# until response headers arrive (streamed bodies are read after release).
+UPSTREAM_QUEUE_MAX = int(os.environ.get("TAHLIA_UPSTREAM_QUEUE", 256))
+TEASER_MAX_WAIT_S = 0.5
+RETRY_AFTER_MAX_S = 60.0
+
+class UpstreamBusy(Exception):
+    pass
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    shed: bool = field(default=False, compare=False)
+
+class UpstreamLimiter:
+    def __init__(self, name: str, rate: float, burst: int, max_concurrency: int, max_queue: int = UPSTREAM_QUEUE_MAX):
+        self.name, self.rate, self.burst = name, rate, burst
+        self.max_concurrency, self.max_queue = max_concurrency, max_queue
+        self.cond = threading.Condition()
+        self.tokens, self.stamp = float(burst), time.monotonic()
+        self.in_flight, self.paused_until, self.seq = 0, 0.0, 0
+        self.queue: list[_Waiter] = []
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def _shed(self, priority: int):
+        metrics.inc("tahlia_upstream_shed_total", upstream=self.name, priority=str(priority))
+        raise UpstreamBusy(f"{self.name} saturated")
+
+    def acquire(self, deadline: Deadline | None):
+        prio = deadline.priority if deadline else PRIORITY_FINAL
+        t0 = time.monotonic()
+        with self.cond:
+            if prio >= PRIORITY_TEASER and any(w.priority < prio for w in self.queue):
+                self._shed(prio)
+            if len(self.queue) >= self.max_queue:
+                victim = max(self.queue)
+                if victim.priority <= prio: self._shed(prio)
+                victim.shed = True
+                self.queue.remove(victim)
+                self.cond.notify_all()
+            self.seq += 1
+            me = _Waiter(prio, self.seq)
+            self.queue.append(me)
+            try:
+                while True:
+                    if me.shed: self._shed(prio)
+                    now = time.monotonic()
+                    self._refill(now)
+                    if (min(self.queue) is me and self.in_flight < self.max_concurrency
+                            and now >= self.paused_until and self.tokens >= 1):
+                        self.tokens -= 1; self.in_flight += 1
+                        break
+                    wait = max(self.paused_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0, 0.01)
+                    if deadline is not None:
+                        if deadline.remaining() <= 0.05: raise DeadlineExceeded()
+                        wait = min(wait, deadline.remaining())
+                    if prio >= PRIORITY_TEASER:
+                        if now - t0 >= TEASER_MAX_WAIT_S: self._shed(prio)
+                        wait = min(wait, TEASER_MAX_WAIT_S - (now - t0))
+                    self.cond.wait(timeout=wait)
+            finally:
+                if me in self.queue: self.queue.remove(me)
+                self.cond.notify_all()
+        metrics.observe("tahlia_stage_seconds", time.monotonic() - t0, stage=f"{self.name}_queue")
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def pause(self, seconds: float):
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + min(seconds, RETRY_AFTER_MAX_S))
+            self.tokens = 0.0
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {f"{self.name}_queued": len(self.queue), f"{self.name}_in_flight": self.in_flight,
+                    f"{self.name}_paused_s": round(max(0.0, self.paused_until - time.monotonic()), 3)}
+
+limiters = {
+    "gemini": UpstreamLimiter("gemini", float(os.environ.get("TAHLIA_GEMINI_RPS", 20)),
+                              int(os.environ.get("TAHLIA_GEMINI_BURST", 40)),
+                              int(os.environ.get("TAHLIA_GEMINI_CONCURRENCY", 64))),
+    "elevenlabs": UpstreamLimiter("elevenlabs", float(os.environ.get("TAHLIA_ELEVEN_RPS", 8)),
+                                  int(os.environ.get("TAHLIA_ELEVEN_BURST", 16)),
+                                  int(os.environ.get("TAHLIA_ELEVEN_CONCURRENCY", 10))),
+}
+
+def retry_after_s(r) -> float:
+    """Seconds from a 429's Retry-After header, or Gemini's RetryInfo.retryDelay; 1s if neither."""
+    try:
+        return float(r.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        pass
+    m = re.search(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"', r.text or "")
+    return float(m.group(1)) if m else 1.0
+
+def upstream_post(url: str, deadline: Deadline | None, timeout: tuple, attempts: int = 3, **kw):
+    """POST through the upstream's limiter; a 429 pauses that upstream and the call queues again
+    (within its deadline). Raises UpstreamBusy when shed, DeadlineExceeded when out of budget."""
+    lim = limiters[upstream_of(url)]
+    for i in range(attempts):
+        lim.acquire(deadline)
+        try:
+            http, t = bounded(deadline, timeout)
+            r = http.post(url, timeout=t, **kw)
+        finally:
+            lim.release()
+        if r.status_code != 429: return r
+        lim.pause(retry_after_s(r))
+        if i == attempts - 1: return r
+        r.close()
+        metrics.inc("tahlia_upstream_retries_total", upstream=lim.name)
+    return r
+
 # ========= Flask =========
 app = Flask(__name__)
 
 # ========= Per-client state =========
-@dataclass
+# Tens of thousands of these can be live, so the layout is compact: slotted classes, short windows
+# as plain-list rings instead of deques, history as tuple records (the reply string is the same
+# object in history, recent_assist and last_reply), and token signatures packed into one bytearray.
+HISTORY_MAX = 16
+SIMILARITY_WINDOW = int(os.environ.get("TAHLIA_SIMILARITY_WINDOW", 6))  # past bot lines checked for repeats (larger is opt-in)
+SIG_BITS = 256
+
+class TurnRecord(NamedTuple):
+    role: str   # "user" | "assistant"
+    text: str
+    tokens: int = 0  # estimate_tokens(text), fixed when the record is made (0: not estimated)
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini token count (~4 chars per token + per-turn framing); only used for budgeting."""
+    return len(text) // 4 + 4
+
+def turn_record(role: str, text: str) -> TurnRecord:
+    return TurnRecord(role, text, estimate_tokens(text))
+
+class Ring:
+    """Bounded list, oldest dropped first: what a deque(maxlen) does here, at a fraction of the size."""
+    __slots__ = ("items", "maxlen")
+    def __init__(self, maxlen: int, items=()):
+        self.maxlen, self.items = maxlen, list(items)[-maxlen:]
+
+    def append(self, x):
+        self.items.append(x)
+        if len(self.items) > self.maxlen: del self.items[0]
+
+    def extend(self, xs):
+        self.items.extend(xs)
+        del self.items[:-self.maxlen]
+
+    def tail(self, n: int):
+        """Last n items as a lazy view (no copy)."""
+        return islice(self.items, max(0, len(self.items) - n), None)
+
+    def clear(self): self.items.clear()
+    def __len__(self): return len(self.items)
+    def __iter__(self): return iter(self.items)
+    def __getitem__(self, i): return self.items[i]
+    def __repr__(self): return f"Ring({self.items!r})"
+
+class SigRing:
+    """Ring of SIG_BITS-wide ints stored back to back in one bytearray (no int object per line)."""
+    __slots__ = ("buf", "maxlen")
+    WIDTH = SIG_BITS // 8
+    def __init__(self, maxlen: int):
+        self.buf, self.maxlen = bytearray(), maxlen
+
+    def append(self, sig: int):
+        self.buf += sig.to_bytes(self.WIDTH, "little")
+        if len(self.buf) > self.maxlen * self.WIDTH: del self.buf[:self.WIDTH]
+
+    def extend(self, sigs):
+        for sig in sigs: self.append(sig)
+
+    def tail(self, n: int):
+        w = self.WIDTH
+        view = memoryview(self.buf)
+        for i in range(max(0, len(self.buf) - n * w), len(self.buf), w):
+            yield int.from_bytes(view[i:i + w], "little")
+
+    def clear(self): self.buf = bytearray()
+    def __len__(self): return len(self.buf) // self.WIDTH
+    def __iter__(self): return self.tail(len(self))
+
+@dataclass(slots=True)
 class ClientState:
-    history: deque = field(default_factory=lambda: deque(maxlen=16))
+    history: Ring = field(default_factory=lambda: Ring(HISTORY_MAX))  # TurnRecords
     intro_sent: bool = False
     last_spoke: str | None = None
     last_reply: str = ""
-    recent_assist: deque = field(default_factory=lambda: deque(maxlen=6))
-    recent_style: deque = field(default_factory=lambda: deque(maxlen=4))
+    recent_assist: Ring = field(default_factory=lambda: Ring(6))
+    recent_style: Ring = field(default_factory=lambda: Ring(4))
     last_adjacent_ts: float = 0.0  # cooldown for teaser generation
-
-state_lock = threading.Lock()
-clients: dict[str, ClientState] = defaultdict(ClientState)
+    assist_sigs: SigRing = field(default_factory=lambda: SigRing(SIMILARITY_WINDOW))  # token_sig() per bot line
+    hist_seq: int = 0        # history entries ever appended …
+    log_seq: int = -1        # … and how many of them are in the turn log (-1: conversation not opened there yet)
+    summary: str = ""        # rolling summary of the entries before …
+    summary_seq: int = 0     # … this one (see history_contents)
+
+# ---- Session store: routes load with get_state(), mutate, then persist with save_state() ----
+SESSION_TTL_S = float(os.environ.get("TAHLIA_SESSION_TTL_S", 2 * 3600))   # idle expiry
+SESSION_MAX = int(os.environ.get("TAHLIA_SESSION_MAX", 20000))             # LRU cap
+SWEEP_INTERVAL_S = 30
+
+class MemoryStore:
+    """In-process LRU; the only store, since the rest of the per-turn state is in-process too.
+    Entries are kept in last-access order, so expiry only ever looks at the oldest end."""
+    def __init__(self, ttl_s: float = SESSION_TTL_S, max_entries: int = SESSION_MAX):
+        self.lock = threading.Lock()
+        self.ttl_s, self.max_entries = ttl_s, max_entries
+        self.clients: OrderedDict[str, list] = OrderedDict()  # cid -> [last_access, ClientState]
+        self.evicted_ttl = self.evicted_lru = 0
+
+    def _put(self, cid: str, st: ClientState):
+        self.clients[cid] = [time.time(), st]
+        self.clients.move_to_end(cid)
+        while len(self.clients) > self.max_entries:
+            self.clients.popitem(last=False)
+            self.evicted_lru += 1
+
+    def load(self, cid: str, default=ClientState) -> ClientState:
+        with self.lock:
+            entry = self.clients.get(cid)
+        st = entry[1] if entry else default()
+        with self.lock:
+            self._put(cid, st)
+            return st
+
+    def peek(self, cid: str) -> ClientState | None:
+        with self.lock:
+            entry = self.clients.get(cid)
+            return entry[1] if entry else None
+
+    def save(self, cid: str, st: ClientState):
+        with self.lock:
+            self._put(cid, st)
+
+    def reset(self, cid: str):
+        self.save(cid, ClientState())
+
+    def sweep(self):
+        cutoff = time.time() - self.ttl_s
+        with self.lock:
+            while self.clients:
+                cid, (ts, _) = next(iter(self.clients.items()))
+                if ts >= cutoff: break
+                del self.clients[cid]
+                self.evicted_ttl += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"sessions": len(self.clients), "evicted_ttl": self.evicted_ttl, "evicted_lru": self.evicted_lru}
+
+store = MemoryStore()
+
+# ---- Durable turn log: restarts and evictions don't wipe conversations ----
+# One append-only JSON-lines file per cid: ["n", intro_sent] opens a conversation, ["x"] is a reset,
+# ["u"|"a", text] is one history entry. save_state() only queues records; a single writer thread
+# appends them in batches (one open/write per cid per batch, no per-turn fsync). get_state()
+# rehydrates a missing session from the file's tail, and files are compacted to their last
+# REHYDRATE_TURNS entries once they grow, and deleted once idle past SESSION_TTL_S.
+TURN_LOG_DIR = os.environ.get("TAHLIA_TURN_LOG_DIR", "turn_log")  # "" disables
+TURN_LOG_FSYNC = os.environ.get("TAHLIA_TURN_LOG_FSYNC", "0") == "1"
+TURN_LOG_BATCH_S = 0.25
+TURN_LOG_COMPACT_BYTES = 32 * 1024
+TURN_LOG_PURGE_S = 600
+REHYDRATE_TURNS = 16
+
+@contextmanager
+def _flocked(path: str):
+    """Binary append handle (readable too) on path under an exclusive flock, reopened until it
+    names the live file: a compaction in another process may have replaced (or purge removed) it
+    while we waited."""
+    while True:
+        f = open(path, "a+b")
+        if fcntl is None: break
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino: break
+        except FileNotFoundError:
+            pass
+        f.close()
+    try:
+        yield f
+    finally:
+        f.close()  # releases the lock
+
+class TurnLog:
+    def __init__(self, root: str):
+        self.root = root
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.pending: list[tuple[str, list]] = []
+        self.writing: dict[str, list] = {}  # taken by flush() but not yet on disk
+        self.writes = 0  # bumped (under cond) each time a cid's batch lands
+        self.records_written = self.rehydrated = self.compactions = 0
+        os.makedirs(root, exist_ok=True)
+        threading.Thread(target=self._writer, name="tahlia-turnlog", daemon=True).start()
+
+    def _path(self, cid: str) -> str:
+        h = hashlib.sha1(cid.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, h[:2], h + ".jsonl")
+
+    def append(self, cid: str, records: list):
+        with self.cond:
+            self.pending.append((cid, records))
+            self.cond.notify()
+
+    def _writer(self):
+        while True:
+            try:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.pending)
+                time.sleep(TURN_LOG_BATCH_S)  # group commit: whatever else arrives meanwhile rides along
+                self.flush()
+            except Exception as e:  # never let the only writer die: appends would queue forever
+                sys.stderr.write(f"\n[TURN LOG] writer: {e!r}\n")
+
+    def flush(self):
+        with self.write_lock:
+            by_cid = defaultdict(list)
+            with self.cond:
+                batch, self.pending = self.pending, []
+                for cid, recs in batch: by_cid[cid].extend(recs)
+                self.writing = dict(by_cid)
+            for cid, recs in by_cid.items():
+                path = self._path(cid)
+                data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in recs).encode("utf-8")
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with _flocked(path) as f:
+                        end = f.seek(0, os.SEEK_END)
+                        if end:  # a crash mid-append leaves a torn last line; start ours on a fresh one
+                            f.seek(end - 1)
+                            if f.read(1) != b"\n": data = b"\n" + data
+                        f.write(data)
+                        if TURN_LOG_FSYNC:
+                            f.flush(); os.fsync(f.fileno())
+                        self.records_written += len(recs)
+                        if f.tell() > TURN_LOG_COMPACT_BYTES:
+                            f.flush()
+                            self._compact(path)  # still under the lock: no append can slip in
+                except Exception as e:  # one bad file must not cost the rest of the batch
+                    sys.stderr.write(f"\n[TURN LOG] {cid}: {e!r}\n")
+                with self.cond:
+                    self.writing.pop(cid, None)
+                    self.writes += 1
+
+    def _tail(self, path: str) -> tuple[list, bool] | None:
+        """(last ≤REHYDRATE_TURNS entries of the open conversation, intro_sent); None if it was reset.
+        Reads backwards in blocks, so cost follows the tail, not the file."""
+        entries, intro, block = [], True, 8192
+        with open(path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos, buf = end, b""
+            while True:
+                pos = max(0, pos - block)
+                f.seek(pos)
+                buf = f.read(end - pos)
+                lines = buf.split(b"\n")
+                if pos > 0: lines = lines[1:]  # first line may be cut
+                entries, marker = [], None
+                for line in reversed(lines):
+                    rec = self._parse(line)
+                    if rec is None: continue
+                    if rec[0] in ("n", "x"):
+                        marker = rec; break
+                    entries.append(rec)
+                    if len(entries) >= REHYDRATE_TURNS: break
+                if marker or len(entries) >= REHYDRATE_TURNS or pos == 0: break
+                block *= 2
+        if marker and marker[0] == "x": return None if not entries else (entries[::-1], False)
+        if marker: intro = bool(marker[1])
+        return entries[::-1], intro
+
+    @staticmethod
+    def _parse(line: bytes) -> list | None:
+        """One record, or None for blank, torn (crash mid-append) or malformed lines."""
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(rec, list) or not rec: return None
+        if rec[0] in ("n", "x") or (rec[0] in ("u", "a") and len(rec) == 2 and isinstance(rec[1], str)):
+            return rec
+        return None
+
+    @staticmethod
+    def _replay(tail: tuple[list, bool] | None, recs: list) -> tuple[list, bool] | None:
+        """Apply records still queued for the writer on top of the on-disk tail (same shape)."""
+        entries, intro = tail if tail else ([], True)
+        alive = tail is not None
+        for rec in recs:
+            if rec[0] == "n": entries, intro, alive = [], bool(rec[1]), True
+            elif rec[0] == "x": entries, intro, alive = [], False, False
+            else: entries.append(rec); alive = True
+        return (entries[-REHYDRATE_TURNS:], intro) if alive else None
+
+    def rehydrate(self, cid: str) -> ClientState | None:
+        path = self._path(cid)
+        while True:  # its latest records may still be queued: replay them rather than flush here
+            with self.cond: seen = self.writes
+            tail = None
+            try:
+                if time.time() - os.path.getmtime(path) <= SESSION_TTL_S: tail = self._tail(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                sys.stderr.write(f"\n[TURN LOG] rehydrate {cid}: {e}\n")
+            with self.cond:
+                if self.writes != seen: continue  # a batch landed mid-read; disk and queue may overlap
+                queued = self.writing.get(cid, []) + [r for c, recs in self.pending if c == cid for r in recs]
+            break
+        if queued: tail = self._replay(tail, queued)
+        if tail is None: return None
+        entries, intro = tail
+        st = ClientState(intro_sent=intro)
+        for code, text in entries:
+            role = "user" if code == "u" else "assistant"
+            add_history(st, role, text)
+            if role == "assistant":
+                remember_assist(st, text)
+                st.last_reply = text
+        st.log_seq = st.hist_seq
+        self.rehydrated += 1
+        return st
+
+    def _compact(self, path: str):
+        """Rewrite path as its tail; the caller holds its _flocked() lock."""
+        tail = self._tail(path)
+        recs = [["x"]] if tail is None else [["n", int(tail[1])]] + tail[0]
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in recs))
+        os.replace(tmp, path)
+        self.compactions += 1
+
+    def purge(self):
+        """Delete logs idle past the session TTL (the session would have expired anyway)."""
+        cutoff = time.time() - SESSION_TTL_S
+        with self.write_lock:
+            for d in os.listdir(self.root):
+                sub = os.path.join(self.root, d)
+                if not os.path.isdir(sub): continue
+                for name in os.listdir(sub):
+                    path = os.path.join(sub, name)
+                    try:
+                        if os.path.getmtime(path) >= cutoff: continue
+                        with _flocked(path):  # another process may be appending right now
+                            if os.path.getmtime(path) < cutoff: os.remove(path)
+                    except OSError:
+                        pass
+
+    def stats(self) -> dict:
+        with self.cond:
+            pending = sum(len(r) for _, r in self.pending)
+        return {"turn_log_pending": pending, "turn_log_written": self.records_written,
+                "turn_log_rehydrated": self.rehydrated, "turn_log_compactions": self.compactions}
+
+turn_log = TurnLog(TURN_LOG_DIR) if TURN_LOG_DIR else None
+
+def _key(cid: str) -> str:
+    return cid or "anon"
 
 def get_state(cid: str) -> ClientState:
-    if not cid:
-        cid = "anon"
-    with state_lock:
-        return clients[cid]
+    key = _key(cid)
+    if turn_log is None: return store.load(key)
+    # Not in the store (new worker, evicted, deploy): rebuild from the turn log's tail
+    return store.load(key, lambda: turn_log.rehydrate(key) or ClientState())
+
+def save_state(cid: str, st: ClientState):
+    key = _key(cid)
+    if turn_log is not None and st.hist_seq != st.log_seq:
+        recs = [] if st.log_seq >= 0 else [["n", int(st.intro_sent)]]
+        new = min(st.hist_seq - max(st.log_seq, 0), len(st.history))
+        recs += [[r.role[0], r.text] for r in st.history.tail(new)]
+        st.log_seq = st.hist_seq
+        turn_log.append(key, recs)
+    store.save(key, st)
+    schedule_summary(key, st)
 
 def reset_state(cid: str):
-    with state_lock:
-        clients[cid] = ClientState()
+    store.reset(_key(cid))
+    if turn_log is not None: turn_log.append(_key(cid), [["x"]])
+
+def peek_state(cid: str) -> ClientState | None:
+    """Read-only lookup that never creates (or refreshes) a session."""
+    return store.peek(_key(cid))
+
+# ---- Per-client locks ----
+# Every load → mutate → save of a ClientState happens under that client's own lock, so clients
+# never contend with each other. Policy for concurrent turns on one cid: finals run one at a
+# time, and a newer final supersedes any older one (see begin_turn); teasers are skipped while
+# the cid is busy.
+class _ClientLock:
+    __slots__ = ("lock", "refs")
+    def __init__(self):
+        self.lock, self.refs = threading.Lock(), 0
+
+_client_locks_guard = threading.Lock()
+_client_locks: dict[str, _ClientLock] = {}  # only cids with a request in flight
+
+@contextmanager
+def client_lock(cid: str, blocking: bool = True):
+    """Hold cid's lock; yields False (lock not taken) if blocking=False and it is busy."""
+    key = _key(cid)
+    with _client_locks_guard:
+        entry = _client_locks.get(key)
+        if entry is None:
+            entry = _client_locks[key] = _ClientLock()
+        entry.refs += 1
+    with span("lock_wait"):
+        got = entry.lock.acquire(blocking)
+    try:
+        yield got
+    finally:
+        if got: entry.lock.release()
+        with _client_locks_guard:
+            entry.refs -= 1
+            if not entry.refs: _client_locks.pop(key, None)
+
+# ---- Turn generations: barge-in cancels superseded work server-side ----
+class TurnCancelled(Exception):
+    pass
+
+_turns_guard = threading.Lock()
+_turns_cond = threading.Condition(_turns_guard)  # notified on every begin_turn (and by await_turn's futures)
+_turns: dict[str, list] = {}  # cid -> [final_gen, teaser_gen, last_touched]; swept with audio clips
+
+class Turn:
+    """One in-flight turn. A final is superseded by any newer final (or intro/reset) on the same
+    cid; a teaser also by any newer teaser. Checked between LLM/TTS stages, never mid-call."""
+    __slots__ = ("key", "gen", "teaser_gen", "final")
+    def __init__(self, key: str, gen: int, teaser_gen: int, final: bool):
+        self.key, self.gen, self.teaser_gen, self.final = key, gen, teaser_gen, final
+
+    @property
+    def cancelled(self) -> bool:
+        cur = _turns.get(self.key)
+        if cur is None: return False
+        return cur[0] != self.gen or (not self.final and cur[1] != self.teaser_gen)
+
+    def check(self):
+        if self.cancelled: raise TurnCancelled()
+
+def begin_turn(cid: str, final: bool = True) -> Turn:
+    key = _key(cid)
+    with _turns_guard:
+        cur = _turns.setdefault(key, [0, 0, 0.0])
+        cur[0 if final else 1] += 1
+        cur[2] = time.time()
+        _turns_cond.notify_all()
+        return Turn(key, cur[0], cur[1], final)
+
+def await_turn(turn: Turn, fut):
+    """fut's result, or TurnCancelled as soon as turn is superseded. The abandoned work finishes
+    unobserved, so a barge-in never waits behind an upstream call whose result is discarded."""
+    def wake(_):
+        with _turns_cond: _turns_cond.notify_all()
+    fut.add_done_callback(wake)
+    with _turns_cond:
+        _turns_cond.wait_for(lambda: fut.done() or turn.cancelled)
+    turn.check()
+    return fut.result()
+
+def purge_turns(max_age_s: float):
+    cutoff = time.time() - max_age_s
+    with _turns_guard:
+        for k in [k for k, v in _turns.items() if v[2] < cutoff]:
+            del _turns[k]
 
 # ========= Prompts and rules =========
 SYSTEM_PROMPT = (
@@ -76,20 +823,56 @@ SYSTEM_PROMPT = (
     "Crisis: if the user indicates imminent self-harm, advise calling 911 or contacting/texting 988 (U.S. crisis line) immediately."
 )
 
-CRISIS_TRIGGERS = ("kill myself","suicide","hurt myself","harm myself","overdose","end my life","take my life","self harm","self-harm")
-STOP_WORDS = ("stop","quit","end","goodbye","end call","terminate")
+CRISIS_TRIGGERS = ("kill myself","suicide","hurt myself","harm myself","overdose","end my life","take my life","self harm","self-harm",
+                   # crisis phrases match as word prefixes ("self-harming", "overdoses"); these are the
+                   # inflections that don't simply extend a phrase
+                   "killing myself","suicidal","hurting myself","harming myself","overdosed","overdosing",
+                   "ending my life","taking my life")
+STOP_WORDS = ("stop","quit","end","goodbye","end call","terminate")  # keep in sync with STOP_RE in the client
+BANNED_PREFIXES = ("i’m here with you", "let’s take it one step at a time")
 
 # ========= Helpers =========
 def norm(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "").strip()).lower()
 
+# ---- Trigger matcher: every phrase list in one compiled regex, word-bounded, one pass per text ----
+class TriggerMatcher:
+    """Named-group alternation over all phrase lists (longest phrase first, so "end my life" wins
+    over "end"). Spaces in a phrase also match hyphens/runs of whitespace; curly apostrophes are
+    folded. Kinds in `prefixes` only need to start at a word boundary and may run on into a longer
+    word (safety phrases: missing a match is worse than an extra one); the rest are whole words.
+    scan() returns typed hits as (kind, phrase, start) and is memoized per text."""
+    def __init__(self, groups: dict[str, tuple], prefixes: tuple = ()):
+        words, open_ended = [], []
+        for kind, phrases in groups.items():
+            ps = sorted({self.fold(p) for p in phrases}, key=len, reverse=True)
+            alt = f"(?P<{kind}>" + "|".join(re.escape(p).replace(r"\ ", r"[\s-]+") for p in ps) + ")"
+            (open_ended if kind in prefixes else words).append(alt)
+        rx = []
+        if open_ended: rx.append(r"(?<!\w)(?:" + "|".join(open_ended) + r")\w*")
+        if words: rx.append(r"(?<![\w'])(?:" + "|".join(words) + r")(?![\w'])")
+        self.rx = re.compile("|".join(rx))
+        self.scan = functools.lru_cache(maxsize=4096)(self._scan)
+
+    @staticmethod
+    def fold(text: str) -> str:
+        return norm(text).replace("’", "'").replace("‘", "'")
+
+    def _scan(self, text: str) -> tuple:
+        return tuple((m.lastgroup, m.group(), m.start()) for m in self.rx.finditer(self.fold(text)))
+
+triggers = TriggerMatcher({"crisis": CRISIS_TRIGGERS, "banned": BANNED_PREFIXES, "stop": STOP_WORDS},
+                          prefixes=("crisis",))
+
 def contains_stop_command(text: str) -> bool:
-    lw = norm(text)
-    return lw in STOP_WORDS or (len(lw) <= 24 and any(w in lw for w in STOP_WORDS))
+    # Only short utterances: "stop" inside a longer sentence is talk, not a command
+    return len(norm(text)) <= 24 and any(kind == "stop" for kind, _, _ in triggers.scan(text))
 
 def detect_crisis(text: str) -> bool:
-    t = norm(text)
-    return any(k in t for k in CRISIS_TRIGGERS)
+    return any(kind == "crisis" for kind, _, _ in triggers.scan(text))
+
+def has_banned_prefix(text: str) -> bool:
+    return any(kind == "banned" and start == 0 for kind, _, start in triggers.scan(text))
 
 def concise(text: str, max_chars: int = 520, max_sents: int = 5) -> str:
     t = (text or "").strip()
@@ -109,20 +892,44 @@ def jaccard(a: set, b: set) -> float:
 def tokset(s: str) -> set:
     return set(re.findall(r"[a-z']+", (s or "").lower()))
 
-def too_similar(new: str, refs: list[str], threshold: float = 0.90) -> bool:
-    A = tokset(new)
-    for r in refs:
-        if not r: continue
-        if jaccard(A, tokset(r)) >= threshold:
+# ---- Token signatures: a line's token set as a SIG_BITS-wide mask, computed once when it is stored ----
+
+@functools.lru_cache(maxsize=65536)
+def _tok_bit(tok: str) -> int:
+    return 1 << (zlib.crc32(tok.encode()) % SIG_BITS)  # crc32, not hash(): stable across workers/pickles
+
+def token_sig(s: str) -> int:
+    sig = 0
+    for t in tokset(s): sig |= _tok_bit(t)
+    return sig
+
+def too_similar(new: str, ref_sigs, threshold: float = 0.90) -> bool:
+    """Jaccard over signatures (popcounts); refs whose size rules out the threshold are skipped."""
+    a = token_sig(new)
+    na = a.bit_count()
+    if not na: return False
+    for b in ref_sigs:
+        nb = b.bit_count()
+        if not nb or min(na, nb) < threshold * max(na, nb): continue
+        if (a & b).bit_count() >= threshold * (a | b).bit_count():
             return True
     return False
 
-BANNED_PREFIXES = ("i’m here with you", "let’s take it one step at a time")
+def remember_assist(st: ClientState, text: str):
+    st.recent_assist.append(text)
+    assist_sigs(st).append(token_sig(text))
+
+def assist_sigs(st: ClientState) -> SigRing:
+    # States saved before signatures existed get them rebuilt from recent_assist on first use
+    if len(st.assist_sigs) < len(st.recent_assist):
+        st.assist_sigs.clear()
+        st.assist_sigs.extend(token_sig(x) for x in st.recent_assist)
+    return st.assist_sigs
 
 def not_duplicate_user(st: ClientState, text: str) -> bool:
     if not st.history: return True
     last = st.history[-1]
-    return not (last[0] == "user" and norm(last[1]) == norm(text))
+    return not (last.role == "user" and norm(last.text) == norm(text))
 
 def not_duplicate_bot(st: ClientState, text: str) -> bool:
     return norm(st.last_reply) != norm(text)
@@ -142,26 +949,120 @@ def choose_style(st: ClientState) -> str:
         return "tip"
     return "story"
 
+# ---- Local pre-filter: turns that never need Gemini ----
+# Backchannels ("yeah", "mm-hmm", "okay") after a statement get a canned nudge; fuzzy echoes of
+# what the bot just said (ASR hearing the speaker, slightly mangled) are dropped. Both cost no
+# upstream call; the nudges are fixed lines, so their audio comes from the TTS cache.
+FILLER_TOKENS = frozenset((
+    "yeah", "yea", "yes", "yep", "yup", "ya", "ok", "okay", "kay", "k", "mm", "mhm", "hmm", "hm", "mmhm",
+    "uh", "huh", "um", "umm", "uhh", "ah", "oh", "right", "sure", "cool", "alright", "gotcha", "true",
+    "exactly", "totally"))
+# Acknowledgements made of ordinary words only count as the whole rest of the utterance, so
+# "oh I see" is a backchannel but "I like it" / "well I got it" are answers
+BACKCHANNEL_PHRASES = frozenset(("i see", "got it", "fair enough", "makes sense", "that makes sense"))
+FILLER_MAX_TOKENS = 4
+BACKCHANNEL_NUDGES = (
+    "Take your time. What's on your mind right now?",
+    "Mm-hm. What would you like to get into next?",
+    "I'm here. What feels most important to talk about?",
+)
+ECHO_MIN_TOKENS = 5         # shorter near-matches are too likely to be a real answer
+ECHO_MIN_COVERAGE = 0.8     # share of the user's words found, in order, in one recent bot line
+ECHO_LINES = 2
+
+_squeeze = re.compile(r"([a-z])\1{2,}")  # "mmmm" → "mm", "hmmm" → "hmm"
+
+def words_of(s: str) -> list[str]:
+    return re.findall(r"[a-z']+", _squeeze.sub(r"\1\1", (s or "").lower().replace("-", " ")))
+
+def is_backchannel(st: ClientState, text: str) -> bool:
+    """Only filler words (plus at most one whole acknowledgement phrase), and the bot's last line
+    wasn't a question (then "yeah" is an answer)."""
+    w = words_of(text)
+    if not 0 < len(w) <= FILLER_MAX_TOKENS or ends_with_question(st.last_reply): return False
+    rest = " ".join(t for t in w if t not in FILLER_TOKENS)
+    return not rest or rest in BACKCHANNEL_PHRASES
+
+def is_fuzzy_echo(st: ClientState, text: str) -> bool:
+    w = words_of(text)
+    if len(w) < ECHO_MIN_TOKENS: return False
+    recent = list(zip(st.recent_assist.tail(ECHO_LINES), assist_sigs(st).tail(ECHO_LINES)))
+    # Signature overlap first: only lines holding most of the user's words get the ordered comparison
+    u = token_sig(text)
+    nu = u.bit_count()
+    for line, sig in recent + [(st.last_reply, token_sig(st.last_reply))]:
+        if not line or (u & sig).bit_count() < ECHO_MIN_COVERAGE * nu: continue
+        sm = SequenceMatcher(None, w, words_of(line), autojunk=False)
+        if sum(b.size for b in sm.get_matching_blocks()) >= ECHO_MIN_COVERAGE * len(w):
+            return True
+    return False
+
+def backchannel_nudge(st: ClientState) -> str:
+    options = [l for l in BACKCHANNEL_NUDGES if l != st.last_reply]
+    return random.choice(options)
+
 # ========= Google Gemini Chat =========
+def gemini_content(role: str, text: str) -> dict:
+    text = text or ""
+    if role == "system":
+        role = "user"
+        text = f"[SYSTEM INSTRUCTIONS]\n{text}"
+    elif role == "assistant":
+        role = "model"
+    else:
+        role = "user"
+    return {"role": role, "parts": [{"text": text}]}
+
 def _to_gemini_contents(messages):
-    contents = []
-    for m in messages:
-        role = m.get("role", "user")
-        text = m.get("content", "") or ""
-        if role == "system":
-            role = "user"
-            text = f"[SYSTEM INSTRUCTIONS]\n{text}"
-        elif role == "assistant":
-            role = "model"
-        else:
-            role = "user"
-        contents.append({"role": role, "parts": [{"text": text}]})
-    return contents
+    # Items already in Gemini form (prebuilt prefix, per-client history) pass through as-is
+    return [m if "parts" in m else gemini_content(m.get("role", "user"), m.get("content", "")) for m in messages]
+
+# ---- Static prompt prefix: built once, shared by every request (never mutate these) ----
+SYSTEM_CONTENT = gemini_content("system", SYSTEM_PROMPT)
+
+GEMINI_CONTEXT_CACHE = os.environ.get("TAHLIA_GEMINI_CONTEXT_CACHE", "0") == "1"
+CONTEXT_CACHE_TTL_S = 3600
+
+class ContextCache:
+    """Gemini cachedContents handle holding SYSTEM_CONTENT, so requests send only the per-turn
+    tail. Refreshed before it expires; if the API refuses (e.g. the prefix is under the model's
+    minimum cacheable size) requests go inline and creation is retried later."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.name, self.expires, self.retry_at = "", 0.0, 0.0
+
+    def get(self) -> str:
+        if not GEMINI_CONTEXT_CACHE: return ""
+        now = time.time()
+        with self.lock:
+            if self.name and now < self.expires - 60: return self.name
+            if now < self.retry_at: return ""
+            self.retry_at = now + 600  # one creator at a time; also the backoff if creation fails
+        url = f"{GEMINI_BASE_URL}/v1beta/cachedContents?key={GOOGLE_API_KEY}"
+        body = {"model": f"models/{GEMINI_MODEL}", "contents": [SYSTEM_CONTENT], "ttl": f"{CONTEXT_CACHE_TTL_S}s"}
+        try:
+            r = session_once.post(url, json=body, timeout=(3, 10))
+            if r.status_code >= 400:
+                sys.stderr.write(f"\n[GEMINI CACHE HTTP {r.status_code}] {r.text[:300]}\n")
+                return ""
+            name = (r.json() or {}).get("name") or ""
+        except Exception as e:
+            sys.stderr.write(f"\n[GEMINI CACHE] {e}\n")
+            return ""
+        with self.lock:
+            self.name, self.expires = name, now + CONTEXT_CACHE_TTL_S
+        return name
+
+    def invalidate(self):
+        with self.lock:
+            self.name, self.expires = "", 0.0
 
-def gemini_chat(messages, model=GEMINI_MODEL, temperature=0.55, max_tokens=360, timeout=DEFAULT_TIMEOUT):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GOOGLE_API_KEY}"
+context_cache = ContextCache()
+
+def _gemini_payload(messages, temperature, max_tokens):
+    contents = _to_gemini_contents(messages)
     payload = {
-        "contents": _to_gemini_contents(messages),
+        "contents": contents,
         "generationConfig": {
             "temperature": float(temperature),
             "maxOutputTokens": int(max_tokens),
@@ -169,267 +1070,1363 @@ def gemini_chat(messages, model=GEMINI_MODEL, temperature=0.55, max_tokens=360,
             "topK": 40
         }
     }
+    if contents and contents[0] is SYSTEM_CONTENT:
+        name = context_cache.get()
+        if name:
+            payload["contents"], payload["cachedContent"] = contents[1:], name
+    return payload
+
+def _post_gemini(url, payload, timeout, deadline, stream=False):
+    """POST to Gemini; if a cachedContent reference is refused (expired, evicted), drop it and
+    resend once with the prefix inline."""
     headers = {"Content-Type": "application/json"}
-    r = session.post(url, headers=headers, json=payload, timeout=timeout)
+    r = upstream_post(url, deadline, timeout, headers=headers, json=payload, stream=stream)
+    if r.status_code >= 400 and "cachedContent" in payload:
+        sys.stderr.write(f"\n[GEMINI CACHE REFUSED {r.status_code}] {r.text[:300]}\n")
+        r.close()
+        context_cache.invalidate()
+        payload = {k: v for k, v in payload.items() if k != "cachedContent"}
+        payload["contents"] = [SYSTEM_CONTENT] + payload["contents"]
+        r = upstream_post(url, deadline, timeout, headers=headers, json=payload, stream=stream)
+    return r
+
+class GeminiHTTPError(RuntimeError):
+    def __init__(self, status: int, body: str = ""):
+        super().__init__(f"Gemini HTTP {status}")
+        self.status, self.body = status, body
+
+# ---- Single-flight: identical concurrent calls share one upstream request ----
+# ASR bursts fire several /api/adjacent calls with the same prefix, and a speculative final can
+# race the real one. Calls are keyed on their normalized contents + generation config + priority
+# (a final never waits on a sheddable teaser's request); teasers also keep a successful result
+# for TEASER_CACHE_TTL_S, since the next interim often repeats the prefix.
+GEMINI_COALESCE = os.environ.get("TAHLIA_GEMINI_COALESCE", "1") == "1"
+TEASER_CACHE_TTL_S = 3.0
+FLIGHT_CACHE_MAX = 512
+
+class SingleFlight:
+    def __init__(self, max_cached: int):
+        self.lock = threading.Lock()
+        self.calls: dict[str, Future] = {}
+        self.cache: OrderedDict[str, tuple[float, object]] = OrderedDict()  # key -> (expires, result)
+        self.max_cached = max_cached
+
+    def do(self, key: str, fn, ttl: float = 0.0, keep=bool, timeout: float | None = None):
+        """fn() once per key among concurrent callers; followers get the leader's result or
+        exception (FutureTimeout after timeout). With ttl, a result keep() accepts is reused."""
+        now = time.time()
+        with self.lock:
+            hit = self.cache.get(key)
+            if hit and hit[0] > now:
+                metrics.inc("tahlia_gemini_coalesced_total", result="cached")
+                return hit[1]
+            fut = self.calls.get(key)
+            leader = fut is None
+            if leader: fut = self.calls[key] = Future()
+        if not leader:
+            metrics.inc("tahlia_gemini_coalesced_total", result="shared")
+            return fut.result(timeout)
+        try:
+            res = fn()
+        except BaseException as e:
+            with self.lock: self.calls.pop(key, None)
+            fut.set_exception(e)
+            raise
+        with self.lock:
+            self.calls.pop(key, None)
+            if ttl > 0 and keep(res):
+                self.cache[key] = (time.time() + ttl, res)
+                while len(self.cache) > self.max_cached: self.cache.popitem(last=False)
+        fut.set_result(res)
+        return res
+
+gemini_flights = SingleFlight(FLIGHT_CACHE_MAX)
+
+def _flight_key(messages, *config) -> str:
+    h = hashlib.sha1(json.dumps(config).encode("utf-8"))
+    for c in _to_gemini_contents(messages):
+        h.update(c["role"].encode("utf-8"))
+        for part in c["parts"]:
+            h.update(b"\0" + " ".join((part.get("text") or "").split()).casefold().encode("utf-8"))
+        h.update(b"\1")
+    return h.hexdigest()
+
+def gemini_candidates(messages, n=1, model=GEMINI_MODEL, temperature=0.55, max_tokens=360, timeout=DEFAULT_TIMEOUT,
+                      deadline: Deadline | None = None, shared: bool = True, cache_s: float = 0.0):
+    """Up to n non-empty candidate texts from one :generateContent call (candidateCount).
+    shared=False opts out of single-flight (independent samples of the same prompt)."""
+    call = lambda: _gemini_candidates(messages, n, model, temperature, max_tokens, timeout, deadline)
+    if not (shared and GEMINI_COALESCE): return call()
+    prio = deadline.priority if deadline else PRIORITY_FINAL
+    key = _flight_key(messages, n, model, float(temperature), int(max_tokens), prio)
+    try:
+        texts, status = gemini_flights.do(key, call, ttl=cache_s, keep=lambda res: res[1] == "ok",
+                                          timeout=max(0.0, deadline.remaining()) if deadline else None)
+    except FutureTimeout:
+        raise DeadlineExceeded()
+    return list(texts), status
+
+def _gemini_candidates(messages, n, model, temperature, max_tokens, timeout, deadline):
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{model}:generateContent?key={GOOGLE_API_KEY}"
+    payload = _gemini_payload(messages, temperature, max_tokens)
+    if n > 1: payload["generationConfig"]["candidateCount"] = int(n)
+    with span("gemini"):
+        r = _post_gemini(url, payload, timeout, deadline)
 
     if r.status_code >= 400:
         sys.stderr.write(f"\n[GEMINI HTTP {r.status_code}] {r.text[:500]}\n")
-        raise RuntimeError(f"Gemini HTTP {r.status_code}")
+        raise GeminiHTTPError(r.status_code, r.text[:500])
 
     data = r.json() or {}
     cands = data.get("candidates") or []
     if not cands:
         pf = data.get("promptFeedback")
         sys.stderr.write(f"\n[GEMINI EMPTY] feedback={json.dumps(pf)[:500]} raw={json.dumps(data)[:500]}\n")
-        return "", "empty"
-
-    first = cands[0]
-    parts = ((first.get("content") or {}).get("parts") or [])
-    text = (parts[0].get("text") if parts else "") or ""
-    if not text.strip():
+        return [], "empty"
+
+    texts = []
+    for cand in cands:
+        parts = ((cand.get("content") or {}).get("parts") or [])
+        text = (parts[0].get("text") if parts else "") or ""
+        if text.strip(): texts.append(text.strip())
+    if not texts:
+        first = cands[0]
         safety = first.get("safetyRatings") or []
         sys.stderr.write(f"\n[GEMINI NO TEXT] safety={json.dumps(safety)[:500]} raw={json.dumps(first)[:500]}\n")
-        return "", "no_text"
-    return text.strip(), "ok"
-
-def llm_reply(st: ClientState, user_text: str) -> tuple[str, str]:
-    msgs = [{"role": "system", "content": SYSTEM_PROMPT}]
-    for role, content in list(st.history)[-12:]:
-        msgs.append({"role": role, "content": content})
-    msgs.append({"role": "user", "content": user_text})
+        return [], "no_text"
+    return texts, "ok"
+
+def gemini_chat(messages, model=GEMINI_MODEL, temperature=0.55, max_tokens=360, timeout=DEFAULT_TIMEOUT,
+                deadline: Deadline | None = None, shared: bool = True, cache_s: float = 0.0):
+    texts, status = gemini_candidates(messages, 1, model, temperature, max_tokens, timeout, deadline, shared, cache_s)
+    return (texts[0] if texts else ""), status
+
+def gemini_stream(messages, model=GEMINI_MODEL, temperature=0.55, max_tokens=360, timeout=DEFAULT_TIMEOUT,
+                  deadline: Deadline | None = None):
+    """Yield text fragments from :streamGenerateContent (SSE) as Gemini produces them."""
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{model}:streamGenerateContent?alt=sse&key={GOOGLE_API_KEY}"
+    payload = _gemini_payload(messages, temperature, max_tokens)
+    t0, first = time.perf_counter(), True
+    with _post_gemini(url, payload, timeout, deadline, stream=True) as r:
+        if r.status_code >= 400:
+            sys.stderr.write(f"\n[GEMINI STREAM HTTP {r.status_code}] {r.text[:500]}\n")
+            raise RuntimeError(f"Gemini HTTP {r.status_code}")
+        for line in r.iter_lines(decode_unicode=True):
+            if first:
+                metrics.observe("tahlia_stage_seconds", time.perf_counter() - t0, stage="gemini_first_token")
+                first = False
+            if not line or not line.startswith("data:"): continue
+            data = json.loads(line[5:]) or {}
+            cands = data.get("candidates") or []
+            if not cands: continue
+            for part in ((cands[0].get("content") or {}).get("parts") or []):
+                if part.get("text"): yield part["text"]
+
+def iter_sentences(chunks):
+    """Re-chunk a stream of text fragments into whole sentences (same split rule as concise)."""
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        parts = re.split(r"(?<=[.!?])\s+", buf)
+        for sent in parts[:-1]:
+            if sent.strip(): yield sent.strip()
+        buf = parts[-1]
+    if buf.strip(): yield buf.strip()
+
+STYLE_CONTENTS = {
+    "inquire": gemini_content("system", (
+        "For THIS reply: Use the Inquire style. Give a short reflection tied to their words, "
+        "then ask ONE precise, non-generic question that helps pinpoint the root cause or a specific blocker. "
+        "No exercise suggestions in this turn."
+    )),
+    "tip": gemini_content("system", (
+        "For THIS reply: Use the Tip style. Offer ONE tailored, concrete suggestion tightly linked to what they said. "
+        "Keep it tiny and situational. Optionally end with a short follow-up question."
+    )),
+    "story": gemini_content("system", (
+        "For THIS reply: Use the Story style. Share a very brief, relatable vignette ('some people find…') "
+        "that normalizes their experience, then invite them back. Keep it 2–3 sentences."
+    )),
+}
 
-    style = choose_style(st)
-    if style == "inquire":
-        msgs.append({"role": "system", "content": (
-            "For THIS reply: Use the Inquire style. Give a short reflection tied to their words, "
-            "then ask ONE precise, non-generic question that helps pinpoint the root cause or a specific blocker. "
-            "No exercise suggestions in this turn."
-        )})
-    elif style == "tip":
-        msgs.append({"role": "system", "content": (
-            "For THIS reply: Use the Tip style. Offer ONE tailored, concrete suggestion tightly linked to what they said. "
-            "Keep it tiny and situational. Optionally end with a short follow-up question."
-        )})
-    else:  # story
-        msgs.append({"role": "system", "content": (
-            "For THIS reply: Use the Story style. Share a very brief, relatable vignette ('some people find…') "
-            "that normalizes their experience, then invite them back. Keep it 2–3 sentences."
-        )})
-
-    dbg = "ok"
+def add_history(st: ClientState, role: str, text: str):
+    st.history.append(turn_record(role, text))
+    st.hist_seq += 1
+
+# ---- Context assembly: newest turns that fit a token budget, older ones as a rolling summary ----
+# History goes in newest-first until CONTEXT_TOKENS is spent (the newest entry always goes in), so
+# a long monologue takes a few slots and short chit-chat gets up to CONTEXT_MAX_TURNS. Entries that fall
+# out of the budget are folded into st.summary in the background (save_state → schedule_summary),
+# never on the reply path; until a fold lands they are simply left out.
+CONTEXT_TOKENS = int(os.environ.get("TAHLIA_CONTEXT_TOKENS", 900))
+CONTEXT_SUMMARY = os.environ.get("TAHLIA_CONTEXT_SUMMARY", "1") == "1"
+SUMMARY_BATCH = 4            # fold once this many entries are waiting …
+CONTEXT_MAX_TURNS = HISTORY_MAX - SUMMARY_BATCH  # … which the history ring still holds past the window
+SUMMARY_MAX_TOKENS = 160
+SUMMARY_BUDGET_S = 15
+_summary_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tahlia-summary")
+_summarizing_lock = threading.Lock()
+_summarizing: set[str] = set()
+
+SUMMARY_CONTENT = gemini_content("system", (
+    "You maintain a running summary of a supportive chat between a student and Tahlia. "
+    "Merge the summary so far with the new turns into at most 4 short sentences: the student's situation, "
+    "what is bothering them, names/classes/dates they mentioned, and what Tahlia already suggested. "
+    "Plain third person, no advice, no quotes."))
+
+def context_window(st: ClientState) -> tuple[int, int]:
+    """(index of the oldest history entry that fits CONTEXT_TOKENS and CONTEXT_MAX_TURNS, tokens used)."""
+    items, used = st.history.items, 0
+    i = len(items)
+    while i > 0 and len(items) - i < CONTEXT_MAX_TURNS:
+        t = items[i - 1].tokens
+        if used + t > CONTEXT_TOKENS and i < len(items): break
+        used += t
+        i -= 1
+    return i, used
+
+def history_contents(st: ClientState) -> list:
+    # Converted per request from the records (~1µs each) rather than kept as a second, dict-heavy
+    # copy of the history on every session
+    start, used = context_window(st)
+    metrics.inc("tahlia_context_tokens_total", used)
+    out = [gemini_content(r.role, r.text) for r in islice(st.history.items, start, None)]
+    if st.summary:
+        out.insert(0, gemini_content("user", f"[EARLIER IN THIS CONVERSATION]\n{st.summary}"))
+    return out
+
+def schedule_summary(key: str, st: ClientState):
+    """Queue a fold of the entries that left the context window once enough are waiting, or when the
+    oldest of them is about to drop out of the history ring."""
+    if not CONTEXT_SUMMARY or not st.history: return
+    first = st.hist_seq - len(st.history)  # seq of st.history[0]
+    start, _ = context_window(st)
+    lo, hi = max(st.summary_seq, first), first + start
+    if hi <= lo: return
+    if hi - lo < SUMMARY_BATCH and not (len(st.history) == st.history.maxlen and lo - first < 2): return
+    with _summarizing_lock:
+        if key in _summarizing: return
+        _summarizing.add(key)
+    turns = [(r.role, r.text) for r in st.history.items[lo - first:start]]
+    _summary_pool.submit(_summarize, key, st.summary, st.summary_seq, turns, hi)
+
+def _summarize(key: str, prev: str, prev_seq: int, turns: list, hi: int):
     try:
-        text, status = gemini_chat(msgs)
+        lines = "\n".join(f"{'Student' if role == 'user' else 'Tahlia'}: {text}" for role, text in turns)
+        ask = (f"Summary so far: {prev}\n\n" if prev else "") + f"New turns:\n{lines}"
+        with span("summary"):
+            text, _ = gemini_chat([SUMMARY_CONTENT, gemini_content("user", ask)], temperature=0.2,
+                                  max_tokens=SUMMARY_MAX_TOKENS, timeout=(3, 15),
+                                  deadline=Deadline(SUMMARY_BUDGET_S, PRIORITY_TEASER))
         if not text:
-            dbg = f"llm_empty_{status}"
-            text = ("Got it—when does school feel toughest: during classes, homework load, or dealing with people there?")
+            metrics.inc("tahlia_summary_total", result="empty"); return
+        with client_lock(key):
+            st = peek_state(key)
+            first = st.hist_seq - len(st.history) if st else 0
+            i = hi - 1 - first
+            # Moved on meanwhile (another fold, a reset, a new conversation): drop this one
+            if (st is None or st.summary_seq != prev_seq or st.hist_seq < hi
+                    or (i >= 0 and st.history[i].text != turns[-1][1])):
+                metrics.inc("tahlia_summary_total", result="stale"); return
+            st.summary, st.summary_seq = concise(text, max_chars=600, max_sents=4), hi
+            store.save(key, st)
+        metrics.inc("tahlia_summary_total", result="ok")
+    except UpstreamBusy:
+        metrics.inc("tahlia_summary_total", result="shed")
     except Exception as e:
-        dbg = "llm_error"
-        sys.stderr.write(f"\n[LLM ERROR] {e}\n")
-        text = ("Quick check-in: what part of school is spiking the stress most today—time pressure, a specific class, or something social?")
+        metrics.inc("tahlia_summary_total", result="error")
+        sys.stderr.write(f"\n[SUMMARY ERROR] {e}\n")
+    finally:
+        with _summarizing_lock:
+            _summarizing.discard(key)
+
+def build_messages(st: ClientState, user_text: str) -> tuple[list, str]:
+    """Gemini contents for a turn: shared static prefix + summary + the history that fits the budget."""
+    style = choose_style(st)
+    msgs = [SYSTEM_CONTENT, *history_contents(st), gemini_content("user", user_text), STYLE_CONTENTS[style]]
+    return msgs, style
 
-    final = concise(text)
+def commit_reply(st: ClientState, user_text: str, final: str, style: str):
+    st.recent_style.append(style)
+    add_history(st, "user", user_text)
+    add_history(st, "assistant", final)
+    remember_assist(st, final)
 
-    # Avoid 3 questions in a row
-    recent_qs = sum(1 for r in list(st.recent_assist)[-3:] if ends_with_question(r))
-    if ends_with_question(final) and recent_qs >= 2:
-        msgs.append({"role": "system", "content": "Regenerate without ending in a question. Keep it specific and user-focused."})
-        try:
-            alt, _ = gemini_chat(msgs)
-            if alt: final = concise(alt); dbg = "regen_no_question"
-        except Exception:
-            pass
+LLM_FALLBACK_EMPTY = "Got it—when does school feel toughest: during classes, homework load, or dealing with people there?"
+LLM_FALLBACK_ERROR = "Quick check-in: what part of school is spiking the stress most today—time pressure, a specific class, or something social?"
 
-    low = norm(final)
-    if low.startswith(BANNED_PREFIXES) or too_similar(final, list(st.recent_assist)):
-        msgs.append({"role": "system", "content": "Regenerate with different wording; be specific to the user's last message. Allow up to 5 sentences if helpful."})
-        try:
-            alt, _ = gemini_chat(msgs)
-            if alt: final = concise(alt); dbg = "regen_diversity"
-        except Exception:
-            pass
+# ---- Speculative candidates: one call for n answers, first one passing the checks wins ----
+LLM_CANDIDATES = int(os.environ.get("TAHLIA_LLM_CANDIDATES", 3))
+_llm_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tahlia-llm")
+_candidate_count_ok = True  # flipped off if the model rejects candidateCount; we then fan out
 
-    st.recent_style.append(style)
-    st.history.append(("user", user_text))
-    st.history.append(("assistant", final))
-    st.recent_assist.append(final)
+def reject_reason(st: ClientState, text: str) -> str:
+    """Why a candidate would have been regenerated before, or "" if it is fine."""
+    # Avoid 3 questions in a row
+    recent_qs = sum(1 for r in st.recent_assist.tail(3) if ends_with_question(r))
+    if ends_with_question(text) and recent_qs >= 2:
+        return "regen_no_question"
+    if has_banned_prefix(text) or too_similar(text, assist_sigs(st)):
+        return "regen_diversity"
+    return ""
+
+def speculative_candidates(msgs, n: int, deadline: Deadline):
+    """Yield candidate texts as they become available, within the deadline. Prefers a single
+    candidateCount call; falls back to n concurrent single-candidate calls."""
+    global _candidate_count_ok
+    if n > 1 and _candidate_count_ok:
+        try:
+            texts, _ = gemini_candidates(msgs, n, deadline=deadline)
+            yield from texts
+            return
+        except GeminiHTTPError as e:
+            # Only a 400 about candidateCount itself turns it off; other 400s (bad prompt, safety
+            # settings, ...) would fail the single-candidate calls just the same
+            if e.status != 400 or not re.search(r"candidate_?count|multiple candidates", e.body, re.I): raise
+            _candidate_count_ok = False
+            sys.stderr.write(f"\n[LLM] candidateCount rejected; fanning out instead: {e.body}\n")
+    futs = [_llm_pool.submit(gemini_chat, msgs, deadline=deadline, shared=False) for _ in range(n)]
+    errors = 0
+    try:
+        for fut in as_completed(futs, timeout=max(0.0, deadline.remaining())):
+            try:
+                text, _ = fut.result()
+            except Exception as e:
+                errors += 1
+                if errors == n: raise e
+                continue
+            if text: yield text
+    except FutureTimeout:
+        sys.stderr.write("\n[LLM] speculative budget exhausted\n")
+    finally:
+        for fut in futs: fut.cancel()
+
+def compose_reply(st: ClientState, user_text: str, deadline: Deadline,
+                  n: int = LLM_CANDIDATES) -> tuple[str, str, str]:
+    """(final, dbg, style) for user_text; reads st but never mutates it.
+    Instead of serial regenerations, asks for n (LLM_CANDIDATES) answers up front and keeps the first
+    that passes reject_reason(); if none does, the first one is used. A missed deadline falls back
+    to the canned line with dbg "llm_deadline"."""
+    with span("compose"):
+        return _compose_reply(st, user_text, deadline, n)
+
+def _compose_reply(st: ClientState, user_text: str, deadline: Deadline, n: int) -> tuple[str, str, str]:
+    msgs, style = build_messages(st, user_text)
+
+    dbg, final, first_reason = "ok", "", ""
+    try:
+        for i, text in enumerate(speculative_candidates(msgs, max(1, n), deadline)):
+            cand = concise(text)
+            reason = reject_reason(st, cand)
+            if reason: metrics.inc("tahlia_regen_total", reason=reason)
+            if i == 0:
+                final, first_reason = cand, reason
+            if not reason:
+                final = cand
+                if i > 0: dbg = first_reason
+                break
+        if not final:
+            dbg = "llm_deadline" if deadline.expired else "llm_empty"
+            final = concise(LLM_FALLBACK_EMPTY)
+    except Exception as e:
+        dbg = ("llm_deadline" if deadline.expired or isinstance(e, DeadlineExceeded)
+               else "llm_shed" if isinstance(e, UpstreamBusy) else "llm_error")
+        sys.stderr.write(f"\n[LLM ERROR] {e!r}\n")
+        final = concise(LLM_FALLBACK_ERROR)
+    return final, dbg, style
+
+_final_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tahlia-final")
+
+def _final_reply(cid: str, snap: ClientState, user_text: str, deadline: Deadline) -> tuple[str, str, str]:
+    spec = take_speculation(cid, snap, user_text, deadline)
+    if spec: return spec[0], "spec_hit", spec[2]
+    return compose_reply(snap, user_text, deadline)
+
+def llm_reply(cid: str, st: ClientState, user_text: str, turn: Turn,
+              deadline: Deadline | None = None) -> tuple[str, str]:
+    """Committed speculation or a fresh compose. The work runs on a snapshot in _final_pool while
+    this thread only waits, so a superseding final gets the client lock back at once. Raises
+    TurnCancelled (with history untouched) if turn is superseded before commit."""
+    fut = _final_pool.submit(with_spans, _final_reply, cid, copy.deepcopy(st), user_text,
+                             deadline or Deadline(REPLY_BUDGET_S))
+    (final, dbg, style), spans = await_turn(turn, fut)
+    if has_request_context(): g.setdefault("spans", []).extend(spans)
+    commit_reply(st, user_text, final, style)
     return final, dbg
 
+def llm_reply_stream(st: ClientState, user_text: str, max_chars: int = 520, max_sents: int = 5,
+                     turn: Turn | None = None, deadline: Deadline | None = None):
+    """Yield (sentence, dbg) as Gemini streams; same limits as concise(). History is updated at the end.
+    No regeneration passes here — earlier sentences are already being spoken. If turn is
+    superseded, the upstream stream is closed and TurnCancelled raised before the next sentence."""
+    msgs, style = build_messages(st, user_text)
+    sents, used, dbg = [], 0, "stream_ok"
+    try:
+        for sent in iter_sentences(gemini_stream(msgs, deadline=deadline or Deadline(REPLY_BUDGET_S))):
+            if turn and turn.cancelled: break
+            room = max_chars - used
+            if len(sent) > room:
+                sent = concise(sent, max_chars=room) if room > 0 else ""
+                if sent: sents.append(sent); yield sent, dbg
+                break
+            sents.append(sent); used += len(sent) + 1
+            yield sent, dbg
+            if len(sents) >= max_sents: break
+    except Exception as e:
+        dbg = ("llm_deadline" if deadline and deadline.expired
+               else "llm_shed" if isinstance(e, UpstreamBusy) else "llm_error")
+        sys.stderr.write(f"\n[LLM STREAM ERROR] {e!r}\n")
+    if turn: turn.check()
+    if not sents:
+        if dbg == "stream_ok": dbg = "llm_empty_stream"
+        fallback = LLM_FALLBACK_EMPTY if dbg == "llm_empty_stream" else LLM_FALLBACK_ERROR
+        sents.append(fallback)
+        yield fallback, dbg
+    commit_reply(st, user_text, " ".join(sents), style)
+
 # ---- Quick teaser (adjacent) ----
 ADJ_MIN_CHARS = 14
 ADJ_COOLDOWN_S = 1.8
-
-def llm_teaser(st: ClientState, user_prefix: str) -> tuple[str, str]:
+TEASER_EMPTY_LINE = "Okay—go on."
+TEASER_CONTENT = gemini_content("system", (
+    "For THIS reply only: Generate a SINGLE short sentence as a provisional response to the user's partial utterance. "
+    "Be concrete and specific to the snippet; avoid long windups and hedging. "
+    "Prefer statements over questions unless a question is obvious and crisp. "
+    "Do not use generic empathy phrases or platitudes. "
+    "This will be spoken immediately and may be replaced by a fuller answer."))
+
+def llm_teaser(st: ClientState, user_prefix: str, turn: Turn | None = None,
+               deadline: Deadline | None = None) -> tuple[str, str]:
     # Do NOT add to history. This is a provisional one-liner based on the prefix only.
-    msgs = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "system", "content":
-         ("For THIS reply only: Generate a SINGLE short sentence as a provisional response to the user's partial utterance. "
-          "Be concrete and specific to the snippet; avoid long windups and hedging. "
-          "Prefer statements over questions unless a question is obvious and crisp. "
-          "Do not use generic empathy phrases or platitudes. "
-          "This will be spoken immediately and may be replaced by a fuller answer.")},
-        {"role": "user", "content": user_prefix.strip()}
-    ]
+    msgs = [SYSTEM_CONTENT, TEASER_CONTENT, gemini_content("user", user_prefix.strip())]
     try:
-        text, status = gemini_chat(msgs, temperature=0.4, max_tokens=40, timeout=(3, 12))
+        with span("teaser"):
+            text, status = gemini_chat(msgs, temperature=0.4, max_tokens=40, timeout=(3, 12),
+                                       deadline=deadline or Deadline(TEASER_BUDGET_S, PRIORITY_TEASER),
+                                       cache_s=TEASER_CACHE_TTL_S)
+        if turn: turn.check()
         if not text:
-            return "Okay—go on.", "adj_empty"
+            return TEASER_EMPTY_LINE, "adj_empty"
         return concise(text, max_chars=140, max_sents=1), "adj_ok"
+    except TurnCancelled:
+        raise
+    except UpstreamBusy:
+        return "", "adj_shed"  # finals are queued for Gemini; a teaser now would only add load
     except Exception as e:
         sys.stderr.write(f"\n[ADJ ERROR] {e}\n")
         return "", "adj_err"
 
+# ---- Speculative finals: interim prefixes pre-compute the final reply ----
+# /api/adjacent starts one background single-candidate compose_reply() per cid and utterance,
+# on the latest prefix once the interims pause for SPEC_SETTLE_S (the speaker has likely stopped
+# and the final is on its way). When the final transcript is close enough to that prefix and
+# history hasn't moved, /api/reply commits the speculative result instead of calling Gemini
+# again; otherwise it is dropped. At most one extra Gemini call per turn; TAHLIA_SPECULATION=0
+# turns it off.
+SPECULATION = os.environ.get("TAHLIA_SPECULATION", "1") == "1"
+SPEC_MIN_CHARS = 24
+SPEC_MIN_COVERAGE = 0.8      # prefix holds ≥80% of the final's words, in order …
+SPEC_MIN_SIMILARITY = 0.9    # … or the two word sets are near-identical
+SPEC_SETTLE_S = 0.3
+SPEC_TTL_S = 20
+# Own pool: a speculation waiting on its Gemini call in _llm_pool can't starve candidate fan-out
+_spec_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tahlia-spec")
+
+class Speculation:
+    __slots__ = ("prefix", "sig", "ts", "started", "cancelled", "future")
+    def __init__(self, prefix: str, sig: tuple):
+        self.prefix, self.sig = prefix, sig
+        self.ts, self.started, self.cancelled, self.future = time.time(), False, False, None
+
+    def check(self):
+        if self.cancelled: raise TurnCancelled()
+
+_spec_lock = threading.Lock()
+_specs: dict[str, Speculation] = {}
+
+def _history_sig(st: ClientState) -> tuple:
+    return st.hist_seq, (st.history[-1] if st.history else None)
+
+def prefix_matches(prefix: str, text: str) -> bool:
+    p, t = re.findall(r"[a-z']+", norm(prefix)), re.findall(r"[a-z']+", norm(text))
+    if not p or not t: return False
+    if t[:len(p)] == p and len(p) >= SPEC_MIN_COVERAGE * len(t): return True
+    return jaccard(set(p), set(t)) >= SPEC_MIN_SIMILARITY
+
+def _run_speculation(spec: Speculation, snap: ClientState):
+    while True:  # until the interims settle, newer prefixes only replace spec.prefix
+        with _spec_lock:
+            wait = spec.ts + SPEC_SETTLE_S - time.time()
+            if wait <= 0 or spec.cancelled:
+                spec.started = True
+                break
+        time.sleep(wait)
+    spec.check()
+    final, dbg, style = compose_reply(snap, spec.prefix, Deadline(REPLY_BUDGET_S, PRIORITY_TEASER), n=1)
+    spec.check()
+    return final, dbg, style
+
+def speculate(cid: str, st: ClientState, prefix: str) -> str:
+    """Queue cid's speculative final on this prefix, or move a still-waiting one to it; an
+    utterance whose speculation already started keeps it (caller holds client_lock)."""
+    if not SPECULATION: return "spec_off"
+    if len(prefix) < SPEC_MIN_CHARS: return "spec_short"
+    key, sig = _key(cid), _history_sig(st)
+    with _spec_lock:
+        cur = _specs.get(key)
+        if cur and cur.sig == sig:
+            if cur.started: return "spec_kept"  # once per utterance; never restarted
+            cur.prefix, cur.ts = prefix, time.time()
+            return "spec_pending"
+        if cur: cur.cancelled = True
+        spec = Speculation(prefix, sig)
+        spec.future = _spec_pool.submit(_run_speculation, spec, copy.deepcopy(st))
+        _specs[key] = spec
+    return "spec_started"
+
+def take_speculation(cid: str, st: ClientState, user_text: str, deadline: Deadline):
+    """Pop cid's speculation; (final, dbg, style) if it matches user_text and is usable in time."""
+    with _spec_lock:
+        spec = _specs.pop(_key(cid), None)
+        if spec and not spec.started:  # the final beat it; don't pay for a duplicate call
+            spec.cancelled = True
+            metrics.inc("tahlia_speculation_total", result="unstarted")
+            return None
+    if spec is None: return None
+    if spec.sig != _history_sig(st) or not prefix_matches(spec.prefix, user_text):
+        spec.cancelled = True
+        metrics.inc("tahlia_speculation_total", result="miss")
+        return None
+    try:
+        with span("spec_wait"):
+            final, dbg, style = spec.future.result(timeout=max(0.0, deadline.remaining()))
+    except Exception:
+        spec.cancelled = True
+        metrics.inc("tahlia_speculation_total", result="failed")
+        return None
+    if dbg.startswith("llm_"):  # fallback line; a fresh call may do better
+        metrics.inc("tahlia_speculation_total", result="fallback")
+        return None
+    metrics.inc("tahlia_speculation_total", result="hit")
+    return final, dbg, style
+
+def drop_speculation(cid: str):
+    with _spec_lock:
+        spec = _specs.pop(_key(cid), None)
+    if spec: spec.cancelled = True
+
+def purge_speculations():
+    cutoff = time.time() - SPEC_TTL_S
+    with _spec_lock:
+        for k in [k for k, sp in _specs.items() if sp.ts < cutoff]:
+            _specs.pop(k).cancelled = True
+
 # ========= ElevenLabs TTS =========
-def tts_b64(text: str):
-    if not ELEVEN_API_KEY: return "", "Missing ELEVENLABS_API_KEY"
-    safe_text = (text or "").strip()
-    if not safe_text: return "", ""
-    safe_text = safe_text[:650]
+STREAM_AUDIO = True   # reply JSON carries a short /api/audio URL instead of a base64 data URI
+AUDIO_TTL_S = 120     # how long a registered clip can be fetched
+TTS_TIMEOUTS = [(5, 20), (5, 25), (6, 35)]
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVEN_VOICE_ID}"
+def _tts_request(text: str, stream: bool = False):
+    url = f"{ELEVEN_BASE_URL}/v1/text-to-speech/{ELEVEN_VOICE_ID}" + ("/stream" if stream else "")
     headers = {"xi-api-key": ELEVEN_API_KEY, "Accept": "audio/mpeg", "Content-Type": "application/json"}
     payload = {
-        "text": safe_text,
+        "text": text,
         "model_id": "eleven_multilingual_v2",
         "voice_settings": {"stability": 0.45, "similarity_boost": 0.85, "style": 0.25, "use_speaker_boost": True},
         "output_format": "mp3_22050_64"
     }
-
-    for i, timeout in enumerate([(5, 20), (5, 25), (6, 35)]):
+    return url, headers, payload
+
+# ---- Content-addressed cache: repeated lines (intro, crisis, fallbacks) skip ElevenLabs ----
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TAHLIA_TTS_CACHE_MB", 64)) * 1024 * 1024
+TTS_CACHE_DIR = os.environ.get("TAHLIA_TTS_CACHE_DIR", "tts_cache")  # "" disables the disk tier
+TTS_CACHE_DISK_MAX_BYTES = int(os.environ.get("TAHLIA_TTS_CACHE_DISK_MB", 256)) * 1024 * 1024
+TTS_PREWARM = os.environ.get("TAHLIA_TTS_PREWARM", "0") == "1"
+TTS_FIXED_LINES: set[str] = set()  # filled in at the bottom; these also go to the disk tier
+
+class TTSCache:
+    """Byte-bounded LRU of MP3s in memory, backed by an optional byte-bounded directory on disk."""
+    def __init__(self, max_bytes: int, disk_dir: str = "", disk_max_bytes: int = 0):
+        self.lock = threading.Lock()
+        self.mem: OrderedDict[str, bytes] = OrderedDict()
+        self.mem_bytes, self.max_bytes = 0, max_bytes
+        self.disk_dir, self.disk_max_bytes = disk_dir, disk_max_bytes
+        self.disk: OrderedDict[str, int] = OrderedDict()  # key -> size, oldest first
+        self.hits = self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            files = [e for e in os.scandir(disk_dir) if e.name.endswith(".mp3")]
+            for e in sorted(files, key=lambda e: e.stat().st_mtime):
+                self.disk[e.name[:-4]] = e.stat().st_size
+
+    @staticmethod
+    def key(text: str) -> str:
+        _, _, payload = _tts_request(text)
+        return hashlib.sha256(json.dumps([ELEVEN_VOICE_ID, payload], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".mp3")
+
+    def _remember(self, key: str, data: bytes):
+        if key in self.mem:
+            self.mem.move_to_end(key); return
+        self.mem[key] = data; self.mem_bytes += len(data)
+        while self.mem_bytes > self.max_bytes and self.mem:
+            _, old = self.mem.popitem(last=False)
+            self.mem_bytes -= len(old)
+
+    def get(self, key: str) -> bytes | None:
+        with self.lock:
+            data = self.mem.get(key)
+            if data is not None:
+                self.mem.move_to_end(key); self.hits += 1
+                return data
+            on_disk = key in self.disk
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                with self.lock:
+                    self._remember(key, data); self.hits += 1
+                return data
+            except OSError:
+                with self.lock:
+                    self.disk.pop(key, None)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes, persist: bool = False):
+        if not data: return
+        with self.lock:
+            self._remember(key, data)
+            if not (persist and self.disk_dir) or key in self.disk: return
+        tmp = self._path(key) + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            sys.stderr.write(f"\n[TTS CACHE] {e}\n"); return
+        with self.lock:
+            self.disk[key] = len(data)
+            while sum(self.disk.values()) > self.disk_max_bytes and len(self.disk) > 1:
+                old, _ = self.disk.popitem(last=False)
+                try: os.remove(self._path(old))
+                except OSError: pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"tts_cache_hits": self.hits, "tts_cache_misses": self.misses,
+                    "tts_cache_bytes": self.mem_bytes, "tts_cache_disk_entries": len(self.disk)}
+
+tts_cache = TTSCache(TTS_CACHE_MAX_BYTES, TTS_CACHE_DIR, TTS_CACHE_DISK_MAX_BYTES)
+
+def tts_open_stream(text: str, deadline: Deadline | None = None):
+    """Open a streaming ElevenLabs response (status already checked). Returns (response, error)."""
+    url, headers, payload = _tts_request(text, stream=True)
+    for i, timeout in enumerate(TTS_TIMEOUTS):
         try:
-            r = session.post(url, headers=headers, json=payload, timeout=timeout)
+            r = upstream_post(url, deadline, timeout, headers=headers, json=payload, stream=True)
             if r.status_code != 200:
-                if i < 2: time.sleep(0.15 * (i + 1)); continue
-                return "", f"TTS HTTP {r.status_code}: {r.text[:200]}"
-            b64 = base64.b64encode(r.content).decode("utf-8")
-            return "data:audio/mpeg;base64," + b64, ""
+                err = f"TTS HTTP {r.status_code}: {r.text[:200]}"
+                r.close()
+                # 429s were already waited out by upstream_post, other 4xx won't change on a resend
+                if r.status_code < 500: return None, err
+                if i < 2 and backoff(deadline, 0.15 * (i + 1)):
+                    metrics.inc("tahlia_upstream_retries_total", upstream="elevenlabs"); continue
+                return None, err
+            return r, ""
+        except DeadlineExceeded:
+            return None, "TTS deadline"
+        except UpstreamBusy:
+            return None, "TTS shed: upstream saturated"
         except Exception as e:
-            if i == 2: return "", f"TTS exception: {e}"
-            time.sleep(0.2 * (i + 1))
-    return "", "TTS unknown error"
+            if i == 2 or not backoff(deadline, 0.2 * (i + 1)): return None, f"TTS exception: {e}"
+            metrics.inc("tahlia_upstream_retries_total", upstream="elevenlabs")
+    return None, "TTS unknown error"
+
+# ---- Streamed clips: synthesized into a growing buffer that any number of fetches can read ----
+# Synthesis runs on a bounded pool (FIFO, so a turn's sentences start in the order they were
+# spoken), never on the request thread. Clips for the same text share one upstream stream: the
+# first is the leader, later ones follow its buffer until it finishes.
+AUDIO_BUFFER_MAX_BYTES = int(os.environ.get("TAHLIA_AUDIO_BUFFER_MB", 64)) * 1024 * 1024
+TTS_WORKERS = int(os.environ.get("TAHLIA_TTS_WORKERS", 16))
+_tts_pool = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tahlia-tts")
+_tts_inflight_lock = threading.Lock()
+_tts_inflight: dict[str, "AudioClip"] = {}  # tts_cache key -> leader clip
 
-# ========= API: introduction =========
-@app.post("/api/intro")
-def api_intro():
-    data = request.get_json(force=True, silent=False) or {}
-    cid = (data.get("cid") or "").strip()
+@dataclass
+class AudioClip:
+    text: str
+    ts: float = field(default_factory=time.time)
+    buf: bytearray = field(default_factory=bytearray)  # bytes so far, while synthesizing
+    data: bytes | None = None  # the whole MP3 once done (the same object the TTS cache holds)
+    done: bool = False
+    error: str = ""
+    started: bool = False
+    turn: "Turn | None" = None  # synthesis stops early once this turn is superseded
+    background: bool = False    # pre-warm: queued behind live turns at the upstream
+    followers: list = field(default_factory=list)  # clips of the same text riding on this one
+    cond: threading.Condition = field(default_factory=threading.Condition)
+
+    def start(self):
+        """Queue synthesis on the TTS pool (idempotent)."""
+        with self.cond:
+            if self.started: return
+            self.started = True
+        _tts_pool.submit(self._synthesize)
+
+    def _finish(self, err: str = "", data: bytes | None = None):
+        with self.cond:
+            self.data = data if data is not None else bytes(self.buf)
+            self.buf = bytearray()
+            self.error, self.done = err, True
+            followers, self.followers = self.followers, []
+            self.cond.notify_all()
+        for f in followers:
+            if err == "superseded":  # our turn went away; theirs may not have
+                with f.cond: f.buf = bytearray()
+                _tts_pool.submit(f._synthesize)
+            else:
+                f._finish(err, self.data)
+
+    def _feed(self, chunk: bytes):
+        with self.cond:
+            self.buf.extend(chunk); self.cond.notify_all()
+
+    def _follow(self, key: str) -> bool:
+        """Ride on an in-flight clip of the same text, or become its leader (False)."""
+        with _tts_inflight_lock:
+            leader = _tts_inflight.setdefault(key, self)
+        if leader is self: return False
+        with leader.cond:
+            if not leader.done:
+                with self.cond: self.buf.extend(leader.buf)
+                leader.followers.append(self)
+                return True
+            data, err = leader.data, leader.error
+        if err:  # finished badly just now: take its place and try again ourselves
+            with _tts_inflight_lock:
+                if _tts_inflight.get(key) is leader: _tts_inflight[key] = self
+            return False
+        self._finish(data=data)
+        return True
+
+    def _synthesize(self):
+        key = tts_cache.key(self.text)
+        cached = tts_cache.get(key)
+        if cached is not None:
+            metrics.inc("tahlia_tts_jobs_total", result="cache")
+            self._finish(data=cached)
+            return
+        if self._follow(key):
+            metrics.inc("tahlia_tts_jobs_total", result="shared")
+            return
+        if self.superseded:  # queued behind other jobs while its turn went away: don't open the stream
+            metrics.inc("tahlia_tts_jobs_total", result="superseded")
+            self._finish("superseded")
+            with _tts_inflight_lock:
+                if _tts_inflight.get(key) is self: del _tts_inflight[key]
+            return
+
+        metrics.inc("tahlia_tts_jobs_total", result="synth")
+        t0 = time.perf_counter()
+        prio = PRIORITY_TEASER if self.background or (self.turn and not self.turn.final) else PRIORITY_FINAL
+        r, err = None, ""
+        try:
+            r, err = tts_open_stream(self.text, Deadline(AUDIO_BUDGET_S, prio))
+            if r is not None:
+                for chunk in r.iter_content(chunk_size=4096):
+                    if self.superseded:
+                        err = "superseded"; break
+                    if chunk:
+                        with self.cond:
+                            if not self.buf:
+                                metrics.observe("tahlia_stage_seconds", time.perf_counter() - t0, stage="tts_first_byte")
+                            self.buf.extend(chunk); self.cond.notify_all()
+                            for f in self.followers: f._feed(chunk)
+        except Exception as e:
+            err = f"TTS stream: {e}"
+        finally:
+            if r is not None: r.close()
+            data = None
+            if not err:  # cached before we leave _tts_inflight, so later clips always find it
+                with self.cond: data = bytes(self.buf)
+                tts_cache.put(key, data, persist=self.text in TTS_FIXED_LINES)
+            self._finish(err, data)
+            with _tts_inflight_lock:
+                if _tts_inflight.get(key) is self: del _tts_inflight[key]
+        metrics.observe("tahlia_stage_seconds", time.perf_counter() - t0, stage="tts_stream")
+
+    @property
+    def superseded(self) -> bool:
+        """Our turn is gone and so is every follower's: nobody is left to hear this."""
+        if not (self.turn and self.turn.cancelled): return False
+        with self.cond:
+            return all(f.turn and f.turn.cancelled for f in self.followers)
+
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.data is not None else len(self.buf)
+
+    def wait_first(self, timeout: float = 40.0) -> bool:
+        """Block until the first bytes (True) or a finished/failed synthesis with no audio (False)."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.size or self.done, timeout=timeout)
+            return bool(self.size)
+
+    def wait_done(self, timeout: float = AUDIO_BUDGET_S) -> bool:
+        with self.cond:
+            return self.cond.wait_for(lambda: self.done, timeout=timeout)
+
+    def iter_bytes(self):
+        """Everything synthesized so far, then the rest as it arrives (tracked by byte offset)."""
+        pos = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.size > pos or self.done, timeout=40.0)
+                src = self.data if self.data is not None else self.buf
+                new, done = bytes(src[pos:]), self.done
+            if not new and not done: return  # upstream stalled
+            pos += len(new)
+            if new: yield new
+            if done and pos >= self.size: return
+
+audio_lock = threading.Lock()
+audio_clips: dict[str, AudioClip] = {}
+
+def purge_audio():
+    """Drop expired clips, then the oldest ones while buffered audio exceeds its byte cap."""
+    now = time.time()
+    with audio_lock:
+        for k in [k for k, c in audio_clips.items() if now - c.ts > AUDIO_TTL_S]:
+            del audio_clips[k]
+        total = sum(c.size for c in audio_clips.values())
+        for k in [k for k, _ in sorted(audio_clips.items(), key=lambda kv: kv[1].ts)]:
+            if total <= AUDIO_BUFFER_MAX_BYTES: break
+            total -= audio_clips.pop(k).size
+
+def register_audio(text: str, turn: "Turn | None" = None) -> str:
+    purge_audio()
+    clip_id = uuid.uuid4().hex
+    with audio_lock:
+        audio_clips[clip_id] = AudioClip(text, turn=turn)
+    return clip_id
+
+def get_clip(clip_id: str) -> AudioClip | None:
+    with audio_lock:
+        clip = audio_clips.get(clip_id)
+    if clip and time.time() - clip.ts > AUDIO_TTL_S:
+        return None
+    return clip
+
+def tts_b64(text: str, turn: "Turn | None" = None, deadline: Deadline | None = None):
+    """Inline data URI: the same pooled, shared synthesis as a clip, waited for here."""
+    clip = AudioClip(text, turn=turn)
+    clip.start()
+    with span("tts"):
+        clip.wait_done(deadline.remaining() if deadline else AUDIO_BUDGET_S)
+    if not clip.done: return "", "TTS deadline"
+    if not clip.data: return "", clip.error or "TTS produced no audio"
+    with span("b64"):
+        return "data:audio/mpeg;base64," + base64.b64encode(clip.data).decode("utf-8"), ""
+
+def speak(text: str, turn: "Turn | None" = None, deadline: "Deadline | None" = None):
+    """Audio for a reply: a short /api/audio URL when streaming, else the inline data URI.
+    Synthesis is queued as soon as the text is known, before the client fetches; a superseded
+    turn's clip stops synthesizing. With less than TTS_MIN_BUDGET_S of the deadline left, no audio."""
+    if turn: turn.check()
+    if deadline and deadline.remaining() < TTS_MIN_BUDGET_S: return "", "deadline: text only"
+    if not ELEVEN_API_KEY: return "", "Missing ELEVENLABS_API_KEY"
+    safe_text = (text or "").strip()
+    if not safe_text: return "", ""
+    if not STREAM_AUDIO: return tts_b64(safe_text[:650], turn, deadline)
+    clip_id = register_audio(safe_text[:650], turn)
+    get_clip(clip_id).start()
+    return "/api/audio/" + clip_id, ""
 
-    reset_state(cid)
-    st = get_state(cid)
-    intro = f"Hey, I'm {ASSISTANT_NAME}. Your mental health assistant."
+# ========= API: introduction =========
+INTRO_LINE = f"Hey, I'm {ASSISTANT_NAME}. Your mental health assistant."
+
+def no_reply(dbg: str) -> dict:
+    return {"reply": "", "audio": "", "tts_error": "", "dbg": dbg}
+
+def counted(route: str):
+    """Count each (payload, status) a turn handler returns by its dbg outcome."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            payload, status = fn(*args, **kwargs)
+            metrics.inc("tahlia_turns_total", route=route, dbg=payload.get("dbg", ""))
+            return payload, status
+        return inner
+    return wrap
+
+# Turn handlers return (payload, status) and are shared by the REST routes and the /ws channel
+@counted("intro")
+def intro_turn(cid: str) -> tuple[dict, int]:
+    st = ClientState()
+    intro = INTRO_LINE
     st.intro_sent = True
     st.last_spoke = None
     st.last_reply = intro
-    st.recent_assist.append(intro)
+    remember_assist(st, intro)
+    begin_turn(cid)  # a fresh conversation supersedes anything still in flight
+    drop_speculation(cid)
+    with client_lock(cid):
+        save_state(cid, st)
 
-    audio, tts_err = tts_b64(intro)
-    return jsonify({"reply": intro, "audio": audio, "tts_error": tts_err, "dbg": "intro"}), 200
+    audio, tts_err = speak(intro)
+    return {"reply": intro, "audio": audio, "tts_error": tts_err, "dbg": "intro"}, 200
 
-# ========= API: chat reply (final) =========
-@app.post("/api/reply")
-def api_reply():
+@app.post("/api/intro")
+def api_intro():
     data = request.get_json(force=True, silent=False) or {}
-    cid = (data.get("cid") or "").strip()
-    st = get_state(cid)
+    payload, status = intro_turn((data.get("cid") or "").strip())
+    return jsonify(payload), status
 
-    user_text = (data.get("text") or "").strip()
+# ========= API: chat reply (final) =========
+CRISIS_REPLY = concise(
+    "I’m really glad you told me. If you’re in immediate danger, call 911. "
+    "In the U.S., you can call or text 988 for the Suicide & Crisis Lifeline. "
+    "Would you like resources now?"
+)
+
+def reply_gate(cid: str, st: ClientState, user_text: str) -> tuple[str, int] | None:
+    """Checks shared by /api/reply and /api/reply_stream (caller holds client_lock). Returns
+    (dbg, status) when the turn should get no reply, else None. A crisis utterance is never
+    dropped here (not as a stop word, an echo or a duplicate): it always gets CRISIS_REPLY."""
     if not user_text:
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": "empty_text"}), 400
+        return "empty_text", 400
 
     lower_text = norm(user_text)
+    if detect_crisis(user_text):
+        st.last_spoke = "user"
+        return None
 
     if contains_stop_command(lower_text):
         reset_state(cid)
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": "stop_word"}), 200
+        drop_speculation(cid)
+        return "stop_word", 200
 
     if lower_text == norm(st.last_reply):
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": "echo_bot_line"}), 200
+        return "echo_bot_line", 200
+
+    if is_fuzzy_echo(st, user_text):
+        metrics.inc("tahlia_prefilter_total", result="echo")
+        return "echo_fuzzy", 200
 
     if len(lower_text) < 1:
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": "too_short"}), 200
+        return "too_short", 200
 
     st.last_spoke = "user"
 
     if not not_duplicate_user(st, lower_text):
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": "duplicate_user"}), 200
-
-    if detect_crisis(lower_text):
-        reply = concise(
-            "I’m really glad you told me. If you’re in immediate danger, call 911. "
-            "In the U.S., you can call or text 988 for the Suicide & Crisis Lifeline. "
-            "Would you like resources now?"
-        )
-        st.history.append(("user", user_text)); st.history.append(("assistant", reply))
-        dbg = "crisis"
-    else:
-        reply, dbg = llm_reply(st, user_text)
+        save_state(cid, st)
+        return "duplicate_user", 200
+    return None
+
+@counted("reply")
+def reply_turn(cid: str, user_text: str) -> tuple[dict, int]:
+    deadline = Deadline(REPLY_BUDGET_S)
+    turn = begin_turn(cid)
+    with client_lock(cid):
+        st = get_state(cid)
+        gate = reply_gate(cid, st, user_text)
+        if gate:
+            dbg, status = gate
+            return no_reply(dbg), status
 
-    if not not_duplicate_bot(st, reply):
-        reply = reply.rstrip(".") + " — when did that start showing up for you?"
-        dbg = "dedup_softened"
+        try:
+            if detect_crisis(user_text):
+                reply = CRISIS_REPLY
+                add_history(st, "user", user_text); add_history(st, "assistant", reply)
+                dbg = "crisis"
+            elif is_backchannel(st, user_text):
+                metrics.inc("tahlia_prefilter_total", result="backchannel")
+                reply = backchannel_nudge(st)
+                add_history(st, "user", user_text); add_history(st, "assistant", reply)
+                dbg = "backchannel"
+            else:
+                metrics.inc("tahlia_prefilter_total", result="llm")
+                turn.check()  # superseded while queued behind an older turn
+                reply, dbg = llm_reply(cid, st, user_text, turn, deadline)
+        except TurnCancelled:
+            # Keep what they said so the newer turn has it as context; drop our reply
+            add_history(st, "user", user_text)
+            save_state(cid, st)
+            return no_reply("superseded"), 200
+
+        if dbg != "crisis" and not not_duplicate_bot(st, reply):  # the crisis line is never reworded
+            reply = reply.rstrip(".") + " — when did that start showing up for you?"
+            dbg = "dedup_softened"
+
+        st.last_reply = reply
+        save_state(cid, st)
+
+    try:
+        audio, tts_err = speak(reply, turn=turn, deadline=deadline)
+    except TurnCancelled:
+        audio, tts_err = "", "superseded"  # reply is committed, but nobody will hear it
+    return {"reply": reply, "audio": audio, "tts_error": tts_err, "dbg": dbg}, 200
+
+@app.post("/api/reply")
+def api_reply():
+    data = request.get_json(force=True, silent=False) or {}
+    payload, status = reply_turn((data.get("cid") or "").strip(), (data.get("text") or "").strip())
+    return jsonify(payload), status
+
+# ========= API: chat reply (streamed, sentence-pipelined) =========
+def sse(obj) -> str:
+    return "data: " + json.dumps(obj) + "\n\n"
+
+def reply_stream_turn(cid: str, user_text: str):
+    """Same turn as reply_turn, as events: one `sentence` per finished sentence (with its own audio
+    URL, synthesis already started) and a closing `done` with the full reply. Returns
+    (payload, status, None) when the gate turns it away, else (None, 200, events)."""
+    deadline = Deadline(REPLY_BUDGET_S)
+    turn = begin_turn(cid)
+    with client_lock(cid):
+        gate = reply_gate(cid, get_state(cid), user_text)
+    if gate:
+        dbg, status = gate
+        metrics.inc("tahlia_turns_total", route="reply_stream", dbg=dbg)
+        return no_reply(dbg), status, None
+
+    def done(reply: str, dbg: str) -> dict:
+        metrics.inc("tahlia_turns_total", route="reply_stream", dbg=dbg)
+        return {"type": "done", "reply": reply, "dbg": dbg}
+
+    def events():
+        # The turn proper runs under the lock for as long as the stream is open; state is
+        # reloaded because another turn may have committed since the gate above.
+        with client_lock(cid):
+            st = get_state(cid)
+            crisis = detect_crisis(user_text)
+            if not crisis and not not_duplicate_user(st, norm(user_text)):
+                yield done("", "duplicate_user"); return
+            if turn.cancelled:
+                add_history(st, "user", user_text)
+                save_state(cid, st)
+                yield done("", "superseded"); return
+            filler = not crisis and is_backchannel(st, user_text)
+            if not crisis: metrics.inc("tahlia_prefilter_total", result="backchannel" if filler else "llm")
+            spec = None if crisis or filler else take_speculation(cid, st, user_text, deadline)
+            if crisis:
+                add_history(st, "user", user_text); add_history(st, "assistant", CRISIS_REPLY)
+                parts = [(CRISIS_REPLY, "crisis")]
+            elif filler:
+                nudge = backchannel_nudge(st)
+                add_history(st, "user", user_text); add_history(st, "assistant", nudge)
+                parts = [(nudge, "backchannel")]
+            elif spec:
+                final, _, style = spec
+                commit_reply(st, user_text, final, style)
+                parts = [(sent, "spec_hit") for sent in iter_sentences([final])]
+            else:
+                parts = llm_reply_stream(st, user_text, turn=turn, deadline=deadline)
+            sents, dbg = [], "stream_ok"
+            try:
+                for sent, dbg in parts:
+                    sents.append(sent)
+                    st.last_reply = " ".join(sents)
+                    audio, tts_err = speak(sent, turn=turn, deadline=deadline)
+                    yield {"type": "sentence", "text": sent, "audio": audio, "tts_error": tts_err}
+            except TurnCancelled:
+                add_history(st, "user", user_text)
+                save_state(cid, st)
+                yield done("", "superseded"); return
+            save_state(cid, st)
+        yield done(" ".join(sents), dbg)
+
+    return None, 200, events()
+
+@app.post("/api/reply_stream")
+def api_reply_stream():
+    data = request.get_json(force=True, silent=False) or {}
+    payload, status, events = reply_stream_turn((data.get("cid") or "").strip(), (data.get("text") or "").strip())
+    if payload is not None:
+        return jsonify(payload), status
 
-    audio, tts_err = tts_b64(reply)
-    st.last_reply = reply
-    return jsonify({"reply": reply, "audio": audio, "tts_error": tts_err, "dbg": dbg}), 200
+    resp = Response((sse(ev) for ev in events), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
 # ========= API: adjacent teaser (provisional) =========
+ADJ_CRISIS_LINE = concise("If you’re in immediate danger, call 911. In the U.S., text or call 988 for the Suicide & Crisis Lifeline.")
+
+@counted("adjacent")
+def adjacent_turn(cid: str, prefix: str) -> tuple[dict, int]:
+    if not prefix or len(prefix) < ADJ_MIN_CHARS:
+        return no_reply("adj_short"), 200
+
+    deadline = Deadline(TEASER_BUDGET_S, PRIORITY_TEASER)
+    turn = begin_turn(cid, final=False)
+    with client_lock(cid, blocking=False) as locked:
+        # A final reply is in flight for this cid; a teaser now would only talk over it
+        if not locked:
+            return no_reply("adj_busy"), 200
+
+        st = get_state(cid)
+        # Crisis/stop checks on prefix just in case; a crisis prefix is never dropped as stop/echo
+        lw = norm(prefix)
+        crisis = detect_crisis(lw)
+        if not crisis and contains_stop_command(lw):
+            return no_reply("adj_stop"), 200
+        if not crisis and is_fuzzy_echo(st, prefix):
+            metrics.inc("tahlia_prefilter_total", result="adj_echo")
+            return no_reply("adj_echo"), 200
+
+        # Start the utterance's speculative final, teaser or not
+        if not crisis:
+            speculate(cid, st, prefix)
+
+        # Cooldown so we don't spam multiple teasers per breath
+        now = time.time()
+        if now - (st.last_adjacent_ts or 0) < ADJ_COOLDOWN_S:
+            return no_reply("adj_cooldown"), 200
+
+        # Claim the cooldown slot before the slow call so concurrent prefixes can't both pass
+        st.last_adjacent_ts = now
+        save_state(cid, st)
+
+    if crisis:
+        teaser = ADJ_CRISIS_LINE
+        audio, tts_err = speak(teaser)
+        return {"reply": teaser, "audio": audio, "tts_error": tts_err, "dbg": "adj_crisis"}, 200
+
+    try:
+        teaser, dbg = llm_teaser(st, prefix, turn, deadline)
+        if not teaser:
+            return no_reply(dbg), 200
+        if deadline.expired:
+            # A teaser is only worth speaking while the user is still mid-utterance
+            return no_reply("adj_deadline"), 200
+
+        # Don't store in history; but keep last_reply for echo filter on client
+        audio, tts_err = speak(teaser, turn=turn)
+    except TurnCancelled:
+        return no_reply("adj_superseded"), 200
+    return {"reply": teaser, "audio": audio, "tts_error": tts_err, "dbg": dbg}, 200
+
 @app.post("/api/adjacent")
 def api_adjacent():
     data = request.get_json(force=True, silent=False) or {}
-    cid = (data.get("cid") or "").strip()
-    prefix = (data.get("prefix") or "").strip()
-    if not prefix or len(prefix) < ADJ_MIN_CHARS:
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": "adj_short"}), 200
-
-    st = get_state(cid)
-    # Cooldown so we don't spam multiple teasers per breath
-    now = time.time()
-    if now - (st.last_adjacent_ts or 0) < ADJ_COOLDOWN_S:
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": "adj_cooldown"}), 200
-
-    # Crisis/stop checks on prefix just in case
-    lw = norm(prefix)
-    if contains_stop_command(lw):
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": "adj_stop"}), 200
-    if detect_crisis(lw):
-        teaser = concise("If you’re in immediate danger, call 911. In the U.S., text or call 988 for the Suicide & Crisis Lifeline.")
-        audio, tts_err = tts_b64(teaser)
-        st.last_adjacent_ts = time.time()
-        return jsonify({"reply": teaser, "audio": audio, "tts_error": tts_err, "dbg": "adj_crisis"}), 200
-
-    teaser, dbg = llm_teaser(st, prefix)
-    if not teaser:
-        return jsonify({"reply": "", "audio": "", "tts_error": "", "dbg": dbg}), 200
-
-    # Don't store in history; but keep last_reply for echo filter on client
-    audio, tts_err = tts_b64(teaser)
-    st.last_adjacent_ts = time.time()
-    return jsonify({"reply": teaser, "audio": audio, "tts_error": tts_err, "dbg": dbg}), 200
+    payload, status = adjacent_turn((data.get("cid") or "").strip(), (data.get("prefix") or "").strip())
+    return jsonify(payload), status
+
+# ========= API: streamed audio =========
+@app.get("/api/audio/<clip_id>")
+def api_audio(clip_id):
+    clip = get_clip(clip_id)
+    if not clip:
+        return jsonify({"error": "unknown_clip"}), 404
+    clip.start()
+    if not clip.wait_first():
+        err = clip.error or "TTS produced no audio"
+        sys.stderr.write(f"\n[TTS STREAM] {err}\n")
+        return jsonify({"error": err}), 502
+
+    # Seeking (or a re-fetch from an offset) into a clip that is still synthesizing: wait for the
+    # whole file so the range can be answered exactly
+    rng = request.range
+    if not clip.done and rng and rng.ranges and rng.ranges[0][0] > 0:
+        clip.wait_done()
+
+    if clip.done and not clip.error:
+        # Raw bytes with Range/ETag support; the id never points at different audio
+        resp = Response(clip.data, mimetype="audio/mpeg")
+        resp.headers["Cache-Control"] = f"private, max-age={int(AUDIO_TTL_S)}, immutable"
+        resp.set_etag(clip_id)
+        return resp.make_conditional(request, accept_ranges=True, complete_length=len(clip.data))
+
+    # Still arriving from ElevenLabs: forward bytes as they come
+    resp = Response(clip.iter_bytes(), mimetype="audio/mpeg")
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
 
 # ========= API: assistant speech ACK =========
+def ack_assistant(cid: str):
+    with client_lock(cid):
+        st = get_state(cid)
+        st.last_spoke = "assistant"
+        save_state(cid, st)
+
 @app.post("/api/ack_assistant")
 def api_ack_assistant():
     data = request.get_json(force=True, silent=False) or {}
-    cid = (data.get("cid") or "").strip()
-    st = get_state(cid)
-    st.last_spoke = "assistant"
+    ack_assistant((data.get("cid") or "").strip())
     return jsonify({"ok": True})
 
 # ========= API: reset memory =========
+def reset_client(cid: str):
+    begin_turn(cid)
+    drop_speculation(cid)
+    with client_lock(cid):
+        reset_state(cid)
+
 @app.post("/api/reset")
 def api_reset():
     data = request.get_json(force=True, silent=False) or {}
-    cid = (data.get("cid") or "").strip()
-    reset_state(cid)
+    reset_client((data.get("cid") or "").strip())
     return jsonify({"ok": True})
 
+# ========= Duplex channel (WebSocket) =========
+# One socket per tab: interim prefixes, finals, play acks and cancels go up; teasers, reply
+# sentences (with audio URLs) and done events come back, tagged with the client's `seq`.
+def ws_session(cid: str, recv, send):
+    """Serve one connection. `recv()` returns the next text frame or None once closed; `send(str)`
+    writes one. Anything that takes the client lock runs on its own thread (a streamed final holds
+    that lock until its last sentence), so the receive loop itself never blocks and cancels and
+    pings are handled at once."""
+    send_lock = threading.Lock()
+
+    def emit(obj):
+        with send_lock:
+            send(json.dumps(obj))
+
+    def spawn(fn, *args):
+        def run():
+            try:
+                fn(*args)
+            except Exception as e:  # socket gone mid-turn; the turn itself already committed
+                sys.stderr.write(f"\n[WS] {cid or 'anon'}: {e}\n")
+        threading.Thread(target=run, daemon=True).start()
+
+    def final(text, seq):
+        payload, _, events = reply_stream_turn(cid, text)
+        if payload is not None:
+            emit({**payload, "type": "done", "seq": seq}); return
+        try:
+            for ev in events:
+                emit({**ev, "seq": seq})
+        finally:
+            events.close()  # releases the client lock if the socket died mid-stream
+
+    def teaser(prefix, seq):
+        emit({**adjacent_turn(cid, prefix)[0], "type": "teaser", "seq": seq})
+
+    def intro(seq):
+        emit({**intro_turn(cid)[0], "type": "intro", "seq": seq})
+
+    def reset(seq):
+        reset_client(cid)
+        emit({"type": "reset", "seq": seq, "ok": True})
+
+    while True:
+        raw = recv()
+        if raw is None: return
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            emit({"type": "error", "error": "bad_json"}); continue
+        kind, seq = msg.get("type"), msg.get("seq")
+        if kind == "final":
+            spawn(final, (msg.get("text") or "").strip(), seq)
+        elif kind == "interim":
+            spawn(teaser, (msg.get("prefix") or "").strip(), seq)
+        elif kind == "ack":
+            spawn(ack_assistant, cid)
+        elif kind == "cancel":
+            begin_turn(cid)  # user barged in: whatever is still generating/synthesizing is moot
+        elif kind == "intro":
+            spawn(intro, seq)
+        elif kind == "reset":
+            spawn(reset, seq)
+        elif kind == "ping":
+            st = peek_state(cid) or ClientState()
+            emit({"type": "pong", "seq": seq, "ts": time.time(), "intro_sent": st.intro_sent, "last_spoke": st.last_spoke})
+        else:
+            emit({"type": "error", "seq": seq, "error": "unknown_type"})
+
+if Sock:
+    app.config.setdefault("SOCK_SERVER_OPTIONS", {"ping_interval": 25})  # keeps proxies from idling it out
+    sock = Sock(app)
+
+    @sock.route("/ws")
+    def ws_channel(ws):
+        def recv():
+            try:
+                return ws.receive()
+            except ConnectionClosed:
+                return None
+        ws_session(request.args.get("cid", "").strip(), recv, ws.send)
+
 # ========= Health/ping =========
 @app.get("/api/ping")
 def api_ping():
     cid = request.args.get("cid", "").strip()
-    st = get_state(cid) if cid else ClientState()
+    st = (peek_state(cid) if cid else None) or ClientState()
     return jsonify({"ok": True, "ts": time.time(), "intro_sent": st.intro_sent, "last_spoke": st.last_spoke})
 
+@app.get("/api/stats")
+def api_stats():
+    with audio_lock:
+        clips = len(audio_clips)
+    logged = turn_log.stats() if turn_log is not None else {}
+    return jsonify({**store.stats(), **tts_cache.stats(), **logged, "audio_clips": clips, "ts": time.time()})
+
+@app.get("/metrics")
+def api_metrics():
+    with audio_lock:
+        clips = len(audio_clips)
+    upstream = {k: v for lim in limiters.values() for k, v in lim.stats().items()}
+    logged = turn_log.stats() if turn_log is not None else {}
+    gauges = {f"tahlia_{k}": v for k, v in {**store.stats(), **tts_cache.stats(), **upstream, **logged}.items()}
+    gauges["tahlia_audio_clips"] = clips
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.before_request
+def _start_timer():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _finish_timer(resp):
+    # Streamed bodies (SSE, audio) are timed to their headers; their stages have their own spans
+    dt = time.perf_counter() - g.get("t0", time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("tahlia_request_seconds", dt, route=route)
+    if SERVER_TIMING:
+        totals = defaultdict(float)
+        for stage, sec in g.get("spans", []): totals[stage] += sec
+        parts = [f"{stage};dur={sec * 1000:.1f}" for stage, sec in totals.items()]
+        resp.headers["Server-Timing"] = ", ".join(parts + [f"total;dur={dt * 1000:.1f}"])
+    return resp
+
+# ========= Background sweeper =========
+def _sweeper():
+    last_log_purge = time.time()
+    while True:
+        time.sleep(SWEEP_INTERVAL_S)
+        try:
+            store.sweep()
+            purge_audio()
+            purge_turns(AUDIO_TTL_S)
+            purge_speculations()
+            if turn_log is not None and time.time() - last_log_purge > TURN_LOG_PURGE_S:
+                turn_log.purge(); last_log_purge = time.time()
+        except Exception as e:
+            sys.stderr.write(f"\n[SWEEP] {e}\n")
+
+threading.Thread(target=_sweeper, name="tahlia-sweeper", daemon=True).start()
+
+# ========= Fixed spoken lines: disk-cached, optionally synthesized at startup =========
+TTS_FIXED_LINES.update(BACKCHANNEL_NUDGES)
+TTS_FIXED_LINES.update({INTRO_LINE, CRISIS_REPLY, ADJ_CRISIS_LINE, TEASER_EMPTY_LINE,
+                        LLM_FALLBACK_EMPTY, LLM_FALLBACK_ERROR})
+
+def _prewarm_tts():
+    clips = [AudioClip(line[:650], background=True) for line in sorted(TTS_FIXED_LINES)]
+    for clip in clips: clip.start()
+    for clip in clips:
+        clip.wait_done()
+        if clip.error: sys.stderr.write(f"\n[TTS PREWARM] {clip.error}\n")
+
+if TTS_PREWARM and ELEVEN_API_KEY:
+    threading.Thread(target=_prewarm_tts, name="tahlia-tts-prewarm", daemon=True).start()
+
 # ========= Favicon =========
 @app.get("/favicon.ico")
 def favicon():
@@ -550,6 +2547,15 @@ const ADJ_DEBOUNCE_MS = 220;
 const ADJ_COOLDOWN_MS = 1800; // match server
 const ADJ_MIN_CHARS = 14;
 
+// ---- Streamed replies: one clip per sentence, played back to back ----
+const STREAM_REPLIES = true;
+let clipQueue = [];
+let streamFirst = true, streamSpoken = "";
+
+// ---- Duplex channel: one WebSocket per tab; the REST routes are the fallback ----
+let wsEnabled = true;   // turned off for good if the server has no /ws
+let ws = null, wsReady = false, wsOpened = false, wsSeq = 0, wsRetryMs = 500;
+
 function setupAudioAnalyzer(){
   if (audioCtx) return;
   try {
@@ -592,12 +2598,14 @@ function jaccard(a, b){
   let inter = 0; for (const x of A) if (B.has(x)) inter++;
   return inter / (A.size + B.size - inter);
 }
+let echoRefLine = "", echoRefWords = [];  // bot line tokenized once, not on every final
 function likelyEcho(userFinal, botLine){
   if (!botLine) return false;
   const now = Date.now();
   if (!assistantSpeaking || !botSpeakingSince) return false;
   if ((now - botSpeakingSince) > ECHO_WINDOW_MS) return false;
-  const ua = words(userFinal), ba = words(botLine);
+  if (botLine !== echoRefLine) { echoRefLine = botLine; echoRefWords = words(botLine); }
+  const ua = words(userFinal), ba = echoRefWords;
   const sim = jaccard(ua, ba);
   const short = userFinal.toLowerCase(), bot = botLine.toLowerCase();
   const prefixish = short.length > 6 && (bot.startsWith(short) || short.startsWith(bot));
@@ -674,7 +2682,7 @@ function ensureASR(){
 
     if (likelyEcho(finalText, lastBotReply)) { logMeta("Echo filtered"); return; }
     if (assistantSpeaking && !wantsInterrupt) return;
-    if (assistantSpeaking && wantsInterrupt) { stopBotAudio(); wantsInterrupt = false; }
+    if (assistantSpeaking && wantsInterrupt) { stopBotAudio(); wantsInterrupt = false; wsSend({ type: "cancel" }); }
 
     if (finalText.length < 1) return;
     const lw = finalText.toLowerCase();
@@ -705,46 +2713,145 @@ async function safeJson(resp){
 }
 
 function stopBotAudio(){
+  clipQueue = [];
   try { player.pause(); player.src = ""; player.currentTime = 0; } catch(_) {}
   assistantSpeaking = false;
   botSpeakingSince = 0;
 }
 
+function connectWS(){
+  if (!wsEnabled || ws || !("WebSocket" in window)) return;
+  const proto = location.protocol === "https:" ? "wss://" : "ws://";
+  ws = new WebSocket(proto + location.host + "/ws?cid=" + encodeURIComponent(clientId));
+  ws.onopen = () => { wsReady = true; wsOpened = true; wsRetryMs = 500; logMeta("Channel open"); };
+  ws.onclose = () => {
+    ws = null; wsReady = false;
+    if (!wsOpened) { wsEnabled = false; logMeta("Channel unavailable → REST"); return; }
+    if (session) { setTimeout(connectWS, wsRetryMs); wsRetryMs = Math.min(wsRetryMs * 2, 15000); }
+  };
+  ws.onmessage = (e) => {
+    let d; try { d = JSON.parse(e.data); } catch { return; }
+    if (d.type === "sentence") onSentence(d);
+    else if (d.type === "done") onDone(d);
+    else if (d.type === "teaser") onTeaser(d);
+    else if (d.type === "intro") onIntro(d);
+    else if (d.type === "error") logErr("Channel: " + d.error);
+  };
+}
+function waitWS(ms){
+  return new Promise(res => {
+    const t0 = Date.now();
+    (function poll(){ if (wsReady || !ws || Date.now() - t0 > ms) res(wsReady); else setTimeout(poll, 40); })();
+  });
+}
+function wsSend(obj){
+  if (!wsReady) return false;
+  try { ws.send(JSON.stringify({ ...obj, seq: ++wsSeq })); return true; } catch(_) { return false; }
+}
+function sendAck(){
+  if (wsSend({ type: "ack" })) return;
+  fetch("/api/ack_assistant", { method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({ cid: clientId }) }).catch(()=>{});
+}
+
+async function playClip(src){
+  try {
+    player.pause(); player.src = src;
+    assistantSpeaking = true; botSpeakingSince = Date.now();
+    setupAudioAnalyzer();
+    if (audioCtx?.state === "suspended") { try { audioCtx.resume(); } catch(_){} }
+    await player.play();
+    sendAck();
+  } catch(e){ logErr("Audio play failed: " + e); }
+}
+
+function enqueueClip(src){
+  if (assistantSpeaking) clipQueue.push(src); else playClip(src);
+}
+
+async function sendToBotStream(text){
+  streamFirst = true; streamSpoken = "";
+  if (wsSend({ type: "final", text })) return;
+  const r = await fetch("/api/reply_stream", {
+    method:"POST", headers:{"Content-Type":"application/json"},
+    body: JSON.stringify({ cid: clientId, text })
+  });
+  if (!(r.headers.get("Content-Type") || "").startsWith("text/event-stream")) {
+    // Gated turn (stop word, echo, duplicate…): plain JSON like /api/reply
+    const d = await safeJson(r);
+    if (d.dbg) logMeta("Server: " + d.dbg);
+    if (d.error_text) logErr("Server raw: " + d.error_text);
+    return;
+  }
+  const reader = r.body.getReader();
+  const dec = new TextDecoder();
+  let buf = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += dec.decode(value, { stream: true });
+    let idx;
+    while ((idx = buf.indexOf("\\n\\n")) >= 0) {
+      const frame = buf.slice(0, idx); buf = buf.slice(idx + 2);
+      if (!frame.startsWith("data:")) continue;
+      let d; try { d = JSON.parse(frame.slice(5)); } catch { continue; }
+      if (d.type === "sentence") onSentence(d);
+      else if (d.type === "done") onDone(d);
+    }
+  }
+}
+
+function onSentence(d){
+  streamSpoken = (streamSpoken + " " + d.text).trim(); lastBotReply = streamSpoken;
+  if (d.tts_error) logErr("TTS: " + d.tts_error);
+  if (d.audio) {
+    // First sentence replaces any teaser currently speaking; the rest queue behind it
+    if (streamFirst) { stopBotAudio(); playClip(d.audio); } else enqueueClip(d.audio);
+    streamFirst = false;
+  }
+}
+function onDone(d){
+  if (d.dbg) logMeta("Server: " + d.dbg);
+  if (d.tts_error) logErr("TTS: " + d.tts_error);
+  if (d.reply) { lastBotReply = d.reply; logBot(d.reply); }
+}
+function onTeaser(d){
+  if (d.dbg) logMeta("Server: " + d.dbg);
+  if (d.error_text) logErr("Server raw: " + d.error_text);
+  if (d.tts_error) logErr("TTS: " + d.tts_error);
+  if (d.reply) { lastBotReply = d.reply; logBot(d.reply + " (teaser)"); }
+  if (d.audio) playClip(d.audio);
+}
+function onIntro(d){
+  introPlayed = true;
+  if (d.dbg) logMeta("Server: " + d.dbg);
+  if (d.reply) { lastBotReply = d.reply; logBot(d.reply); }
+  if (d.tts_error) logErr("TTS: " + d.tts_error);
+  if (d.audio) playClip(d.audio);
+}
+
 async function fireAdjacent(prefix){
   // cooldown window
   adjCooldownUntil = Date.now() + ADJ_COOLDOWN_MS;
+  if (wsSend({ type: "interim", prefix })) return;
 
   try {
     const r = await fetch("/api/adjacent", {
       method:"POST", headers:{"Content-Type":"application/json"},
       body: JSON.stringify({ cid: clientId, prefix })
     });
-    const d = await safeJson(r);
-    if (d.dbg) logMeta("Server: " + d.dbg);
-    if (d.error_text) logErr("Server raw: " + d.error_text);
-    if (d.tts_error) logErr("TTS: " + d.tts_error);
-
-    if (d.reply) { lastBotReply = d.reply; logBot(d.reply + " (teaser)"); }
-    if (d.audio) {
-      try {
-        player.pause(); player.src = d.audio;
-        assistantSpeaking = true; botSpeakingSince = Date.now();
-        setupAudioAnalyzer();
-        if (audioCtx?.state === "suspended") { try { audioCtx.resume(); } catch(_){} }
-        await player.play();
-        fetch("/api/ack_assistant", { method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({ cid: clientId }) }).catch(()=>{});
-      } catch(e){ logErr("Audio play failed: " + e); }
-    }
+    onTeaser(await safeJson(r));
   } catch(e){
     logErr("Fetch /api/adjacent failed: " + e);
   }
 }
 
+// Whole words only, so "weekend"/"friend" don't end the call (server: STOP_WORDS)
+const STOP_RE = /(^|[^\\w'])(end call|goodbye|terminate|stop|quit|end)(?![\\w'])/;
+
 async function sendToBot(text){
   const lw = (text || "").trim().toLowerCase();
 
-  if (["stop","quit","end","goodbye","end call","terminate"].includes(lw) ||
-      (lw.length <= 24 && ["stop","quit","end","goodbye","end call","terminate"].some(k => lw.includes(k)))) {
+  if (lw.length <= 24 && STOP_RE.test(lw)) {
     session = false; introPlayed = false;
     try { stopASRSafe(); } catch(_){}
     if (asrWatchdog) { clearInterval(asrWatchdog); asrWatchdog = null; }
@@ -760,6 +2867,11 @@ async function sendToBot(text){
 
   if (lastBotReply && lw === lastBotReply.toLowerCase()) return;
 
+  if (STREAM_REPLIES) {
+    try { await sendToBotStream(text); } catch(e){ logErr("Fetch /api/reply_stream failed: " + e); }
+    return;
+  }
+
   try {
     const r = await fetch("/api/reply", {
       method:"POST", headers:{"Content-Type":"application/json"},
@@ -785,7 +2897,7 @@ async function sendToBot(text){
         setupAudioAnalyzer();
         if (audioCtx?.state === "suspended") { try { audioCtx.resume(); } catch(_){} }
         await player.play();
-        fetch("/api/ack_assistant", { method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({ cid: clientId }) }).catch(()=>{});
+        sendAck();
       } catch(e){ logErr("Audio play failed: " + e); }
     }
   } catch(e){
@@ -794,7 +2906,10 @@ async function sendToBot(text){
 }
 
 player.onpause = () => { assistantSpeaking = false; botSpeakingSince = 0; ball.style.transform = "scale(1)"; };
-player.onended = () => { assistantSpeaking = false; botSpeakingSince = 0; ball.style.transform = "scale(1)"; };
+player.onended = () => {
+  assistantSpeaking = false; botSpeakingSince = 0; ball.style.transform = "scale(1)";
+  if (clipQueue.length) playClip(clipQueue.shift());
+};
 
 document.addEventListener("visibilitychange", () => {
   if (document.visibilityState === "visible" && session) startASRSafe(120);
@@ -817,23 +2932,14 @@ startBtn.addEventListener("click", async () => {
     session = true; startBtn.textContent = "■ End Conversation";
     await startASRSafe(80);
 
+    connectWS();
     try {
       if (!introPlayed) {
-        const resp = await fetch("/api/intro", { method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({ cid: clientId }) });
-        const d = await safeJson(resp);
-        introPlayed = true;
-        if (d.dbg) logMeta("Server: " + d.dbg);
-        if (d.reply) { lastBotReply = d.reply; logBot(d.reply); }
-        if (d.tts_error) logErr("TTS: " + d.tts_error);
-        if (d.audio) {
-          try {
-            player.pause(); player.src = d.audio;
-            assistantSpeaking = true; botSpeakingSince = Date.now();
-            setupAudioAnalyzer();
-            if (audioCtx?.state === "suspended") { try { audioCtx.resume(); } catch(_){} }
-            await player.play();
-            fetch("/api/ack_assistant", { method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({ cid: clientId }) }).catch(()=>{});
-          } catch(e){ logErr("Audio play failed: " + e); }
+        if ((await waitWS(800)) && wsSend({ type: "intro" })) {
+          introPlayed = true;
+        } else {
+          const resp = await fetch("/api/intro", { method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({ cid: clientId }) });
+          onIntro(await safeJson(resp));
         }
       }
     } catch(e){ logErr("Intro failed: " + e); }
@@ -842,6 +2948,7 @@ startBtn.addEventListener("click", async () => {
     try { stopASRSafe(); } catch(_){}
     if (asrWatchdog) { clearInterval(asrWatchdog); asrWatchdog = null; }
     try { player.pause(); } catch(_) {}
+    if (ws) { try { ws.close(); } catch(_) {} }
   }
 });
 </script>
@@ -0,0 +1,421 @@
+# bench.py — load test for Tahlia against local stand-ins for Gemini and ElevenLabs
+# - Mock upstream serves :generateContent, :streamGenerateContent (SSE), cachedContents and
+#   text-to-speech[/stream] with configurable latency, jitter, 5xx rate and 429s (with Retry-After)
+# - N simulated clients run intro → interim prefixes (/api/adjacent) → finals (/api/reply or
+#   /api/reply_stream) and fetch every reply's audio like the browser does
+# - Reports p50/p95/p99 time-to-reply and time-to-audio, turns/s and upstream calls per turn
+# - --memory N: bytes per live session (N sessions with full history windows) against the original
+#   ClientState layout, no servers
+#
+# Usage:
+#   python bench.py --clients 20 --turns 5                    # app in-process, mocks on localhost
+#   python bench.py --clients 50 --stream --rate429 0.05 --out bench_output.txt
+#   python bench.py --target http://127.0.0.1:5050 --mock-port 9099
+#     (start the server with TAHLIA_GEMINI_BASE_URL / TAHLIA_ELEVEN_BASE_URL = the mock URL it prints)
+#   python bench.py --memory 5000
+
+import argparse, gc, json, logging, os, pickle, random, re, sys, threading, time, tracemalloc
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# ========= Canned upstream output =========
+REPLIES = [
+    "That sounds exhausting. What usually happens right before it gets this bad?",
+    "It makes sense you'd feel stretched thin. Who around you knows how hard this has been?",
+    "Some people find that naming the feeling out loud takes a little of its weight away.",
+    "That's a lot to carry at once. Which part of it feels most urgent today?",
+    "It sounds like sleep has been slipping. What does a typical night look like lately?",
+    "One small move: write down the next single step, not the whole plan. Could you try that tonight?",
+    "I hear how much you care about getting this right. Where did that pressure first come from?",
+    "That kind of tension often shows up in the body too. Have you noticed it anywhere?",
+    "You've been managing a lot on your own. What would help you feel a bit less alone in it?",
+    "It's okay that this feels messy. What would a slightly better week look like for you?",
+    "That sounds really frustrating. When did you first notice it building up?",
+    "Thanks for telling me that. What's been the hardest moment since it started?",
+]
+TEASERS = ["Mm, I'm with you.", "Okay, go on.", "That sounds hard.", "I'm listening.", "Right, keep going."]
+
+UTTERANCES = [
+    "I have been feeling really overwhelmed at work this month",
+    "my sleep has been terrible and I keep waking up at three",
+    "I had an argument with my sister and I can't stop thinking about it",
+    "lately I just feel tired all the time even on the weekends",
+    "I keep putting off things that matter and then I feel guilty",
+    "my manager gave me feedback that really stung this week",
+    "I moved to a new city and I don't really know anyone yet",
+    "I get anxious before meetings and my chest feels tight",
+    "I've been scrolling on my phone for hours every night",
+    "I want to start exercising again but I never find the energy",
+]
+
+def mp3_bytes(text: str) -> bytes:
+    # ~1 KB per character is close to 128 kbps speech; the app never decodes it
+    return b"ID3" + os.urandom(16) + b"\x00" * max(2000, 1000 * len(text))
+
+# ========= Mock upstream =========
+class MockUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, args):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.args = args
+        self.calls = Counter()      # kind -> requests
+        self.status = Counter()     # (kind, status) -> responses
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, kind: str, status: int):
+        with self.lock:
+            self.calls[kind] += 1
+            self.status[(kind, status)] += 1
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"  # body ends at close, so SSE/chunked streams need no framing
+
+    def log_message(self, *a):
+        pass
+
+    def do_POST(self):
+        try:
+            self._post()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the app closed a stream early (superseded turn, barge-in): expected, not an error
+
+    def _post(self):
+        a = self.server.args
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            payload = {}
+
+        path = self.path.split("?")[0]
+        if ":streamGenerateContent" in path: kind = "gemini_stream"
+        elif ":generateContent" in path: kind = "gemini"
+        elif path.endswith("/cachedContents"): kind = "gemini_cache"
+        elif "/text-to-speech/" in path: kind = "tts_stream" if path.endswith("/stream") else "tts"
+        else:
+            self.server.count("unknown", 404)
+            return self.reply(404, {"error": "not found"})
+
+        time.sleep(max(0.0, random.gauss(a.latency_ms, a.jitter_ms)) / 1000)
+        roll = random.random()
+        if roll < a.rate429:
+            self.server.count(kind, 429)
+            return self.reply(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}},
+                              {"Retry-After": str(a.retry_after)})
+        if roll < a.rate429 + a.error_rate:
+            self.server.count(kind, 503)
+            return self.reply(503, {"error": {"code": 503, "status": "UNAVAILABLE"}})
+        self.server.count(kind, 200)
+
+        if kind == "gemini_cache":
+            return self.reply(200, {"name": "cachedContents/bench", "model": payload.get("model")})
+        if kind.startswith("tts"):
+            return self.audio(mp3_bytes(payload.get("text") or ""), stream=kind == "tts_stream")
+
+        cfg = payload.get("generationConfig") or {}
+        pool = TEASERS if int(cfg.get("maxOutputTokens") or 360) < 100 else REPLIES
+        n = int(cfg.get("candidateCount") or 1)
+        texts = random.sample(pool, min(n, len(pool)))
+        if kind == "gemini":
+            return self.reply(200, {"candidates": [{"content": {"parts": [{"text": t}], "role": "model"}} for t in texts]})
+
+        # SSE: a few words per event, like the real endpoint
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = texts[0].split(" ")
+        for i in range(0, len(words), 4):
+            chunk = " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")
+            ev = {"candidates": [{"content": {"parts": [{"text": chunk}], "role": "model"}}]}
+            self.wfile.write(b"data: " + json.dumps(ev).encode() + b"\r\n\r\n")
+            self.wfile.flush()
+            time.sleep(a.chunk_ms / 1000)
+
+    def reply(self, status: int, obj, headers=None):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def audio(self, data: bytes, stream: bool):
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        if not stream: self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        step = 4096 if stream else len(data)
+        for i in range(0, len(data), step):
+            self.wfile.write(data[i:i + step])
+            if stream:
+                self.wfile.flush()
+                time.sleep(self.server.args.chunk_ms / 4000)  # audio chunks come faster than text events
+
+# ========= Simulated clients =========
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ttr, self.tta, self.adj, self.intro = [], [], [], []
+        self.dbg = Counter()
+        self.errors = Counter()
+        self.turns = 0
+
+    def add(self, name: str, value: float):
+        with self.lock: getattr(self, name).append(value)
+
+    def note(self, dbg: str = "", error: str = ""):
+        with self.lock:
+            if dbg: self.dbg[dbg] += 1
+            if error: self.errors[error] += 1
+
+def fetch_audio(http: requests.Session, base: str, url: str) -> float | None:
+    """Seconds to the first audio byte (the whole clip is drained), or None on failure."""
+    t0 = time.perf_counter()
+    with http.get(base + url, stream=True, timeout=60) as r:
+        if r.status_code != 200: return None
+        first = None
+        for chunk in r.iter_content(chunk_size=8192):
+            if chunk and first is None: first = time.perf_counter() - t0
+        return first
+
+def final_rest(http, base, cid, text, res: Results):
+    t0 = time.perf_counter()
+    r = http.post(base + "/api/reply", json={"cid": cid, "text": text}, timeout=60)
+    d = r.json()
+    res.add("ttr", time.perf_counter() - t0)
+    res.note(d.get("dbg", ""))
+    if d.get("audio"):
+        first = fetch_audio(http, base, d["audio"])
+        if first is None: res.note(error="audio_fetch")
+        else: res.add("tta", time.perf_counter() - t0)
+    elif d.get("reply"):
+        res.note(error="no_audio")
+
+def final_stream(http, base, cid, text, res: Results):
+    t0 = time.perf_counter()
+    r = http.post(base + "/api/reply_stream", json={"cid": cid, "text": text}, stream=True, timeout=60)
+    if not r.headers.get("Content-Type", "").startswith("text/event-stream"):
+        res.add("ttr", time.perf_counter() - t0)
+        res.note(r.json().get("dbg", ""))
+        return
+    first_audio = None
+    for line in r.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"): continue
+        ev = json.loads(line[5:])
+        if ev.get("type") == "sentence" and first_audio is None:
+            res.add("ttr", time.perf_counter() - t0)
+            first_audio = ev.get("audio") or ""
+            if first_audio:
+                # Play the first sentence while the rest of the reply is still streaming in
+                if fetch_audio(http, base, first_audio) is None: res.note(error="audio_fetch")
+                else: res.add("tta", time.perf_counter() - t0)
+        elif ev.get("type") == "done":
+            if first_audio is None: res.add("ttr", time.perf_counter() - t0)
+            res.note(ev.get("dbg", ""))
+    r.close()
+
+def run_client(i: int, base: str, args, res: Results, adj_pool: ThreadPoolExecutor):
+    http = requests.Session()
+    cid = f"bench-{i}-{random.randrange(1 << 30):x}"
+    rng = random.Random(i)
+    try:
+        t0 = time.perf_counter()
+        d = http.post(base + "/api/intro", json={"cid": cid}, timeout=60).json()
+        res.add("intro", time.perf_counter() - t0)
+        if d.get("audio"): fetch_audio(http, base, d["audio"])
+
+        for turn in range(args.turns):
+            words = UTTERANCES[(i + turn) % len(UTTERANCES)].split()
+            # Speak word by word; every few words (and on the last) the browser sends its interim
+            # transcript, then finalizes after the end-of-speech silence
+            for n in range(1, len(words) + 1):
+                time.sleep(args.word_ms / 1000)
+                prefix = " ".join(words[:n])
+                if (n % args.interim_every == 0 or n == len(words)) and len(prefix) >= 14:
+                    adj_pool.submit(adjacent, http, base, cid, prefix, res)
+            time.sleep(args.endpoint_ms / 1000)
+            text = " ".join(words)
+            (final_stream if args.stream else final_rest)(http, base, cid, text, res)
+            with res.lock: res.turns += 1
+            time.sleep(rng.uniform(0.5, 1.5) * args.think_ms / 1000)
+    except Exception as e:
+        res.note(error=type(e).__name__)
+
+def adjacent(http, base, cid, prefix, res: Results):
+    t0 = time.perf_counter()
+    try:
+        d = http.post(base + "/api/adjacent", json={"cid": cid, "prefix": prefix}, timeout=30).json()
+        res.add("adj", time.perf_counter() - t0)
+        res.note(d.get("dbg", ""))
+    except Exception as e:
+        res.note(error="adjacent_" + type(e).__name__)
+
+# ========= Report =========
+def pct(xs, p):
+    if not xs: return float("nan")
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+def speculation_counts(base: str) -> Counter:
+    """tahlia_speculation_total by result, scraped from the server's /metrics."""
+    counts = Counter()
+    try:
+        text = requests.get(base + "/metrics", timeout=10).text
+    except requests.RequestException:
+        return counts
+    for m in re.finditer(r'^tahlia_speculation_total\{result="(\w+)"\} (\S+)$', text, re.M):
+        counts[m.group(1)] += int(float(m.group(2)))
+    return counts
+
+def report(args, res: Results, mock: MockUpstream, elapsed: float, spec: Counter) -> str:
+    out = [f"clients={args.clients} turns={args.turns} stream={args.stream} latency={args.latency_ms}±{args.jitter_ms}ms "
+           f"errors={args.error_rate:.0%} 429={args.rate429:.0%}",
+           f"elapsed {elapsed:.1f}s, {res.turns} finals, {res.turns / elapsed:.2f} turns/s", ""]
+    out.append(f"{'':16}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}   (ms)")
+    for name, label in (("ttr", "time-to-reply"), ("tta", "time-to-audio"), ("adj", "adjacent"), ("intro", "intro")):
+        xs = getattr(res, name)
+        out.append(f"{label:16}{len(xs):>6}" + "".join(f"{pct(xs, p) * 1000:>9.0f}" for p in (50, 95, 99)))
+    turns = max(1, res.turns)
+    out += ["", "upstream calls (per final turn):"]
+    for kind, n in sorted(mock.calls.items()):
+        codes = ", ".join(f"{s}×{c}" for (k, s), c in sorted(mock.status.items()) if k == kind)
+        out.append(f"  {kind:14}{n:>7}  {n / turns:6.2f}/turn   [{codes}]")
+    out.append(f"  {'total':14}{sum(mock.calls.values()):>7}  {sum(mock.calls.values()) / turns:6.2f}/turn")
+    taken = sum(spec.values())
+    out += ["", f"speculation: {spec['hit'] / taken if taken else 0:.0%} hit rate over {taken} finals "
+            + "(" + (", ".join(f"{k}={v}" for k, v in spec.most_common()) or "none") + ")"]
+    out += ["dbg: " + ", ".join(f"{k}={v}" for k, v in res.dbg.most_common())]
+    if res.errors:
+        out.append("client errors: " + ", ".join(f"{k}={v}" for k, v in res.errors.most_common()))
+    return "\n".join(out)
+
+# ========= Memory per session =========
+class BaselineState:
+    """The original ClientState layout (dataclass of deques of (role, text) tuples, before the
+    prompt/ring rewrites), kept here as the yardstick for --memory."""
+    def __init__(self):
+        self.history, self.intro_sent, self.last_spoke, self.last_reply = deque(maxlen=16), False, None, ""
+        self.recent_assist, self.recent_style = deque(maxlen=6), deque(maxlen=4)
+        self.last_adjacent_ts = 0.0
+
+def _measure(build, n: int) -> tuple[float, float]:
+    """(traced heap bytes, pickled bytes) per session for n sessions from build(i)."""
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    sessions = [build(i) for i in range(n)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    pickled = sum(len(pickle.dumps(st, protocol=pickle.HIGHEST_PROTOCOL)) for st in sessions[:500]) / min(n, 500)
+    return used / n, pickled
+
+def memory_report(n: int, turns: int = 0) -> str:
+    """Build n steady-state sessions the way the routes do (intro + enough turns to fill every
+    window, the SIMILARITY_WINDOW of bot-line signatures included) and measure traced heap per
+    session and pickled; the same turns through BaselineState give the before figure."""
+    os.environ.update({"TAHLIA_TURN_LOG_DIR": "", "TAHLIA_TTS_CACHE_DIR": ""})
+    import app as tahlia
+    turns = turns or max(12, tahlia.SIMILARITY_WINDOW)
+
+    def lines(i: int, t: int) -> tuple[str, str]:
+        # unique text, like real traffic
+        return f"{UTTERANCES[(i + t) % len(UTTERANCES)]} ({i}.{t})", f"{REPLIES[(i + t) % len(REPLIES)]} ({i}.{t})"
+
+    def session(i: int):
+        st = tahlia.ClientState()
+        st.intro_sent = True
+        tahlia.remember_assist(st, tahlia.INTRO_LINE)
+        for t in range(turns):
+            user, reply = lines(i, t)
+            tahlia.commit_reply(st, user, reply, "inquire")
+            st.last_reply = reply
+        return st
+
+    def baseline(i: int):
+        st = BaselineState()
+        st.intro_sent = True
+        st.recent_assist.append(tahlia.INTRO_LINE)
+        for t in range(turns):
+            user, reply = lines(i, t)
+            st.recent_style.append("inquire")
+            st.history.append(("user", user)); st.history.append(("assistant", reply))
+            st.recent_assist.append(reply)
+            st.last_reply = reply
+        return st
+
+    before, before_pickled = _measure(baseline, n)
+    used, pickled = _measure(session, n)
+    text = sum(len(r.encode()) for st in [baseline(i) for i in range(min(n, 100))] for _, r in st.history) / min(n, 100)
+    return (f"{n} sessions, {turns} turns, {min(turns + 1, tahlia.SIMILARITY_WINDOW)} bot lines in the similarity window: "
+            f"{used:,.0f} bytes/session in memory vs {before:,.0f} baseline "
+            f"(history text itself ~{text:,.0f} bytes), {pickled:,.0f} bytes/session pickled vs {before_pickled:,.0f}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test Tahlia against mock Gemini/ElevenLabs servers.")
+    ap.add_argument("--clients", type=int, default=10)
+    ap.add_argument("--turns", type=int, default=4, help="finals per client after the intro")
+    ap.add_argument("--stream", action="store_true", help="use /api/reply_stream instead of /api/reply")
+    ap.add_argument("--word-ms", type=float, default=220, help="simulated speaking pace")
+    ap.add_argument("--interim-every", type=int, default=3, help="send an interim prefix every N words")
+    ap.add_argument("--endpoint-ms", type=float, default=600, help="silence before the final transcript")
+    ap.add_argument("--think-ms", type=float, default=1500, help="pause between turns (listening to the reply)")
+    ap.add_argument("--latency-ms", type=float, default=350)
+    ap.add_argument("--jitter-ms", type=float, default=120)
+    ap.add_argument("--chunk-ms", type=float, default=40, help="gap between streamed upstream chunks")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered 503")
+    ap.add_argument("--rate429", type=float, default=0.0, help="fraction of upstream calls answered 429")
+    ap.add_argument("--retry-after", type=int, default=1)
+    ap.add_argument("--mock-port", type=int, default=0)
+    ap.add_argument("--target", default="", help="benchmark an already running server instead of in-process")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="", help="also write the report here")
+    ap.add_argument("--memory", type=int, default=0, metavar="N", help="only measure bytes per session over N sessions")
+    ap.add_argument("--memory-turns", type=int, default=0, help="turns per session for --memory (default: fill every window)")
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    if args.memory:
+        print(memory_report(args.memory, args.memory_turns))
+        return
+
+    mock = MockUpstream(args.mock_port, args)
+    threading.Thread(target=mock.serve_forever, daemon=True).start()
+
+    if args.target:
+        base = args.target.rstrip("/")
+        print(f"mock upstream at {mock.url} — the target must run with "
+              f"TAHLIA_GEMINI_BASE_URL={mock.url} TAHLIA_ELEVEN_BASE_URL={mock.url}", file=sys.stderr)
+    else:
+        os.environ.update({"TAHLIA_GEMINI_BASE_URL": mock.url, "TAHLIA_ELEVEN_BASE_URL": mock.url,
+                           "TAHLIA_TTS_CACHE_DIR": "", "TAHLIA_TURN_LOG_DIR": ""})
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        import app as tahlia
+        srv = make_server("127.0.0.1", 0, tahlia.app, threaded=True)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{srv.server_port}"
+
+    res = Results()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(4, args.clients)) as adj_pool:
+        clients = [threading.Thread(target=run_client, args=(i, base, args, res, adj_pool)) for i in range(args.clients)]
+        for t in clients:
+            t.start(); time.sleep(random.uniform(0, 0.05))  # stagger connects
+        for t in clients: t.join()
+    text = report(args, res, mock, time.perf_counter() - t0, speculation_counts(base))
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f: f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# gunicorn.conf.py — read automatically by `gunicorn app:app`
+# gevent workers: every upstream wait (Gemini, ElevenLabs, retry backoff sleeps, streamed audio)
+# yields to other requests instead of pinning a worker thread, so one process can hold hundreds
+# of in-flight conversations.
+# Run ONE worker. Sessions, audio clips, turn generations (barge-in cancels), speculations and
+# per-client locks all live in the worker's memory: on a second worker an /api/audio fetch 404s
+# and cancels/locks don't reach the turn they target. Multi-worker scaling is not supported; the
+# most that works is several single-worker instances behind a proxy that pins each cid to one.
+import os, sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5050)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+if workers > 1:
+    sys.stderr.write(f"[gunicorn.conf] WEB_CONCURRENCY={workers} is unsupported: clips, cancels and client locks "
+                     "are per worker, so audio fetches and barge-ins that land on another worker fail\n")
+worker_class = "gevent"
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 500))
+timeout = 120          # a stuck worker is restarted; individual upstream calls time out well before this
+graceful_timeout = 30
+keepalive = 5
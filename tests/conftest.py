@@ -0,0 +1,6 @@
+import os, sys
+
+# Import app.py from the repo root without writing a turn log or TTS cache into it
+os.environ.setdefault("TAHLIA_TURN_LOG_DIR", "")
+os.environ.setdefault("TAHLIA_TTS_CACHE_DIR", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
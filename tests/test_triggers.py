@@ -0,0 +1,45 @@
+import pytest
+
+import app
+
+OLD_CRISIS = app.CRISIS_TRIGGERS[:9]  # the phrases the original substring scan knew
+SHAPES = ("{}", "i keep {}", "i've been {} again", "'{}'", "\"{}.\"", "({})", "so—{}—yeah", "{}, honestly")
+SUFFIXES = ("", "s", "ed", "ing", "al", "es")
+
+
+def test_crisis_covers_old_substring_scan():
+    """Every utterance the old `k in norm(text)` scan flagged in these shapes is still flagged."""
+    samples = [shape.format(p + suffix) for p in OLD_CRISIS for suffix in SUFFIXES for shape in SHAPES]
+    samples += ["I've been self-harming again", "I keep self harming", "I took overdoses before", "Suicidal thoughts"]
+    missed = [t for t in samples if any(k in app.norm(t) for k in OLD_CRISIS) and not app.detect_crisis(t)]
+    assert not missed
+
+
+@pytest.mark.parametrize("text", ["I want to end my life", "End my life", "i’ve thought about taking my life"])
+def test_crisis_is_not_stop(text):
+    assert app.detect_crisis(text)
+    assert not app.contains_stop_command(text)
+
+
+@pytest.mark.parametrize("text", ["stop", "Stop.", "quit", "goodbye!", "end call", "ok, end", "terminate"])
+def test_stop_commands(text):
+    assert app.contains_stop_command(text)
+
+
+@pytest.mark.parametrize("text", [
+    "weekend", "my weekend", "a friend", "unstoppable", "don't", "the ending", "quite",
+    "please stop worrying about me and tell me more",  # longer sentences are talk, not commands
+])
+def test_not_stop_commands(text):
+    assert not app.contains_stop_command(text)
+
+
+@pytest.mark.parametrize("text", ["I’m here with you. What happened?", "I'm here with you.",
+                                  "Let’s take it one step at a time."])
+def test_banned_prefix(text):
+    assert app.has_banned_prefix(text)
+
+
+@pytest.mark.parametrize("text", ["What happened? I’m here with you.", "I'm here with your sister's note."])
+def test_banned_only_as_prefix_and_whole_words(text):
+    assert not app.has_banned_prefix(text)